@@ -1,5 +1,20 @@
+import os
+import logging
 import streamlit as st
 
+from data_handling_modules import stage_timer
+
+# e.g. H3D_LOG_LEVEL=DEBUG streamlit run app.py, WARNING shows only problems
+logging.basicConfig(
+    level=os.environ.get("H3D_LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+# H3D_TRACE_MEMORY=1 records the peak memory of every stage, for the whole
+# server process (tracemalloc is global and slows every session down)
+if os.environ.get("H3D_TRACE_MEMORY") == "1":
+    stage_timer.trace_memory()
+
 pages = [
     st.Page("st_pages/full_data_dashboard.py", title=" 📈 Full Data Dashboard",),
     # st.Page("st_pages/heatmap_spectrum.py", title=" 📊 Heatmap and Spectrum Analysis"),
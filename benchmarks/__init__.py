@@ -0,0 +1,8 @@
+"""
+Benchmarks of the H3D analysis pipeline, run from the repository root, e.g.
+    python -m benchmarks.bench_pipeline --modules 100 --bins 2000 --output before.json
+
+- synthetic: writes H3D CSV files with configurable modules, bins and metadata.
+- bench_pipeline: timed and memory-profiled extract, transform and plot scenarios.
+- bench_peak_roi, bench_parallel_parse: focused comparisons of single stages.
+"""
@@ -0,0 +1,66 @@
+"""
+Benchmark of serial against parallel module parsing on a synthetic sweep.
+
+Writes a 500-position, 2000-bin H3D CSV (or reuses --csv), scans it once and
+times H3DScanner.read_modules with 1 worker and with process and thread pools,
+checking that every mode returns the same modules in the same order.
+
+Run from the repository root:
+    python -m benchmarks.bench_parallel_parse --modules 500 --workers 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from data_handling_modules import H3DScanner
+from benchmarks.synthetic import write_h3d_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modules", type=int, default=500)
+    parser.add_argument("--bins", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--csv", help="Existing H3D CSV to parse instead of a synthetic one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = args.csv
+        if csv_file is None:
+            csv_file = write_h3d_csv(
+                os.path.join(tmp_dir, "synthetic.csv"), args.modules, args.bins
+            )
+        size_mb = os.path.getsize(csv_file) / 1e6
+
+        scanner = H3DScanner(csv_file).scan()
+        timings, outputs = {}, {}
+        for label, workers, executor in [
+            ("serial", 1, "process"),
+            (f"{args.workers} processes", args.workers, "process"),
+            (f"{args.workers} threads", args.workers, "thread"),
+        ]:
+            start = time.perf_counter()
+            outputs[label] = scanner.read_modules(workers=workers, executor=executor)
+            timings[label] = time.perf_counter() - start
+
+    serial = outputs["serial"]
+    for label, df_list in outputs.items():
+        assert len(df_list) == len(serial)
+        for df, df_serial in zip(df_list, serial):
+            pd.testing.assert_frame_equal(df, df_serial)
+
+    print(f"{scanner.number_of_modules} modules x {scanner.n_bins} bins, {size_mb:.0f} MB")
+    for label, seconds in timings.items():
+        print(
+            f"  {label:<14s} {seconds:8.2f} s  {size_mb / seconds:8.1f} MB/s"
+            f"  {timings['serial'] / seconds:5.1f}x"
+        )
+    print("  outputs identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the peak ROI statistics on a synthetic 2000-bin Cs137 sweep.
+
+Compares the per-row Series.apply path (calculate_peak_count, calculate_bin_max
+and calculate_peak_height on every pixel of every module) with the batched
+TransformDf.add_roi_stats_all, and checks that both give identical columns.
+
+Run from the repository root:
+    python -m benchmarks.bench_peak_roi --modules 300
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_handling_modules import TransformDf
+from benchmarks.synthetic import synthetic_spectra
+
+CS137 = {"bin_peak": 1800, "peak_halfwidth": 22, "threshold": 60, "n_bins": 2000}
+
+
+def synthetic_sweep(n_modules, n_bins=2000, bin_peak=1800, seed=0):
+    """Extracted module DataFrames holding the spectra of benchmarks.synthetic."""
+    rng = np.random.default_rng(seed)
+    pixel_index = pd.RangeIndex(1, 122, name="H3D_Pixel")
+    columns = [str(b) for b in range(n_bins)]
+    return [
+        pd.DataFrame(
+            synthetic_spectra(rng, len(pixel_index), n_bins, bin_peak),
+            index=pixel_index,
+            columns=columns,
+        )
+        for _ in range(n_modules)
+    ]
+
+
+def per_row_roi_stats(TD, bin_peak, peak_halfwidth, threshold):
+    """The previous implementation: one Python call per pixel and per statistic."""
+    for df_new in TD.df_transformed_list:
+        df_new["peak_count"] = df_new["array_bins"].apply(
+            lambda x: TD.calculate_peak_count(x, bin_peak, peak_halfwidth)
+        )
+        df_new["non_peak_count"] = df_new["total_count"] - df_new["peak_count"]
+        df_new["bin_max"] = df_new["array_bins"].apply(
+            lambda x: TD.calculate_bin_max(x, bin_peak, peak_halfwidth, threshold)
+        )
+        df_new["peak_height"] = df_new["array_bins"].apply(
+            lambda x: TD.calculate_peak_height(x, bin_peak, peak_halfwidth, threshold)
+        )
+    return TD.df_transformed_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modules", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df_list = synthetic_sweep(args.modules, CS137["n_bins"], CS137["bin_peak"])
+    roi_args = (CS137["bin_peak"], CS137["peak_halfwidth"], CS137["threshold"])
+    columns = ["peak_count", "non_peak_count", "bin_max", "peak_height"]
+
+    TD_row, TD_batch = TransformDf(), TransformDf()
+    TD_row.transform_all_df(df_list)
+    TD_batch.transform_all_df(df_list)
+
+    timings = {}
+    for label, TD, run in [
+        ("per-row apply", TD_row, per_row_roi_stats),
+        ("add_roi_stats_all", TD_batch, TransformDf.add_roi_stats_all),
+    ]:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run(TD, *roi_args)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+
+    for df_row, df_batch in zip(TD_row.df_transformed_list, TD_batch.df_transformed_list):
+        for column in columns:
+            np.testing.assert_array_equal(df_row[column].values, df_batch[column].values)
+
+    print(f"{args.modules} modules x 121 pixels x {CS137['n_bins']} bins (best of {args.repeat})")
+    for label, seconds in timings.items():
+        print(f"  {label:<20s} {seconds * 1e3:10.1f} ms")
+    print(f"  speedup {timings['per-row apply'] / timings['add_roi_stats_all']:.1f}x, results identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Timed and memory-profiled scenarios of the extract, transform and plot pipeline.
+
+Writes a synthetic H3D sweep (or uses --csv), runs every scenario --repeat times
+for the wall time and once more under tracemalloc for the peak memory, and
+writes the results with the commit and library versions as JSON. Pass the JSON
+of an earlier commit to --compare to print the ratios.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --modules 100 --bins 2000 --output after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from data_handling_modules import (
+    CountTable,
+    ExtractModule,
+    ExtractModuleStreamlit,
+    TransformDf,
+)
+from plotting_modules import create_count_sweep, create_spectrum_pixel_sweep
+from benchmarks.synthetic import write_h3d_csv
+
+PIXELS = [(2, 4), (2, 5), (6, 6), (10, 8)]
+
+
+class Pipeline:
+    """The intermediate results shared by the scenarios, built once on first use."""
+
+    def __init__(self, csv_file, bin_peak, peak_halfwidth, threshold):
+        self.csv_file = csv_file
+        self.bin_peak = bin_peak
+        self.peak_halfwidth = peak_halfwidth
+        self.threshold = threshold
+        self._df_list = None
+        self._TD = None
+
+    @property
+    def df_list(self):
+        if self._df_list is None:
+            self._df_list = ExtractModuleStreamlit(self.csv_file).extract_all_modules2df()
+        return self._df_list
+
+    @property
+    def TD(self):
+        """Transformed sweep with the peak statistics."""
+        if self._TD is None:
+            self._TD = TransformDf()
+            self._TD.transform_all_df(self.df_list)
+            self._TD.add_roi_stats_all(self.bin_peak, self.peak_halfwidth, self.threshold)
+        return self._TD
+
+    @property
+    def x_values(self):
+        return list(range(len(self.df_list)))
+
+
+# name: (setup(pipeline) -> args, run(*args)), setup is not timed
+SCENARIOS = {
+    "ExtractModule.extract_all_modules2df": (
+        lambda p: (p.csv_file,),
+        lambda csv_file: ExtractModule(csv_file).extract_all_modules2df(),
+    ),
+    "ExtractModuleStreamlit.extract_all_modules2df": (
+        lambda p: (p.csv_file,),
+        lambda csv_file: ExtractModuleStreamlit(csv_file).extract_all_modules2df(),
+    ),
+    "TransformDf.transform_all_df": (
+        lambda p: (p.df_list,),
+        lambda df_list: TransformDf().transform_all_df(df_list),
+    ),
+    "TransformDf.add_peak_counts_all": (
+        lambda p: (p.TD.copy_transformed(), p.bin_peak, p.peak_halfwidth),
+        TransformDf.add_peak_counts_all,
+    ),
+    "TransformDf.add_bin_max_all": (
+        lambda p: (p.TD.copy_transformed(), p.bin_peak, p.peak_halfwidth, p.threshold),
+        TransformDf.add_bin_max_all,
+    ),
+    "create_count_sweep": (
+        lambda p: (p.TD.df_transformed_list, "peak_count", 0, len(p.df_list), p.x_values, *PIXELS),
+        create_count_sweep,
+    ),
+    "CountTable.from_cube": (
+        lambda p: (p.TD.cube, p.bin_peak, p.peak_halfwidth, p.threshold),
+        CountTable.from_cube,
+    ),
+    "create_count_sweep[count_table]": (
+        lambda p: (
+            CountTable.from_cube(p.TD.cube, p.bin_peak, p.peak_halfwidth, p.threshold),
+            "peak_count", 0, len(p.df_list), p.x_values, *PIXELS,
+        ),
+        create_count_sweep,
+    ),
+    "create_spectrum_pixel_sweep": (
+        lambda p: (p.TD.cube, 6, 6, 0, len(p.df_list), p.x_values),
+        create_spectrum_pixel_sweep,
+    ),
+}
+
+
+def measure(run, args, repeat):
+    """Wall times of repeat runs, then the peak traced memory of one more run."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds_best": min(seconds),
+        "seconds_median": statistics.median(seconds),
+        "peak_memory_mb": peak / 1e6,
+        "repeat": repeat,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    """Prints the time and memory ratios against the results of an earlier run."""
+    with open(baseline_file) as file:
+        baseline = json.load(file)
+    print(f"\ncompared with {baseline_file} (commit {baseline.get('commit')}), ratio < 1 is faster")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]
+        time_ratio = result["seconds_best"] / before["seconds_best"]
+        memory_ratio = result["peak_memory_mb"] / max(before["peak_memory_mb"], 1e-9)
+        print(f"  {name:<46s} time {time_ratio:6.2f}x  memory {memory_ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modules", type=int, default=100)
+    parser.add_argument("--bins", type=int, default=2000, help="200 or 2000 in H3D exports")
+    parser.add_argument("--metadata-lines", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--csv", help="Existing H3D CSV to use instead of a synthetic one")
+    parser.add_argument("--bin-peak", type=int, help="90 %% of --bins by default")
+    parser.add_argument("--peak-halfwidth", type=int, default=22)
+    parser.add_argument("--threshold", type=int, default=60)
+    parser.add_argument("--scenarios", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    args = parser.parse_args()
+
+    bin_peak = args.bin_peak if args.bin_peak is not None else int(0.9 * args.bins)
+    names = args.scenarios or list(SCENARIOS)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = args.csv
+        if csv_file is None:
+            csv_file = write_h3d_csv(
+                os.path.join(tmp_dir, "synthetic.csv"),
+                args.modules,
+                args.bins,
+                bin_peak,
+                metadata_lines=args.metadata_lines,
+            )
+        pipeline = Pipeline(csv_file, bin_peak, args.peak_halfwidth, args.threshold)
+
+        results = {}
+        for name in names:
+            setup, run = SCENARIOS[name]
+            results[name] = measure(run, setup(pipeline), args.repeat)
+            print(
+                f"  {name:<46s} {results[name]['seconds_best'] * 1e3:10.1f} ms"
+                f"  {results[name]['peak_memory_mb']:8.1f} MB"
+            )
+        n_modules = len(pipeline.df_list)
+        size_mb = os.path.getsize(csv_file) / 1e6
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "versions": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "plotly": plotly.__version__,
+        },
+        "config": {
+            "csv": args.csv,
+            "modules": n_modules,
+            "bins": args.bins,
+            "metadata_lines": args.metadata_lines,
+            "file_mb": size_mb,
+            "bin_peak": bin_peak,
+            "peak_halfwidth": args.peak_halfwidth,
+            "threshold": args.threshold,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Synthetic H3D sweeps for the benchmarks.
+
+Writes CSV files with the same layout as the H3D software export: a few stage
+metadata rows before every module, an H3D_Pixel header row and one row per pixel
+holding a Gaussian photopeak on a flat Poisson background.
+"""
+
+import numpy as np
+
+
+def synthetic_spectra(rng, n_pixels=121, n_bins=2000, bin_peak=1800):
+    """(n_pixels, n_bins) Poisson counts with a photopeak at bin_peak."""
+    bins = np.arange(n_bins)
+    expected = 2 + 80 * np.exp(-0.5 * ((bins - bin_peak) / 8) ** 2)
+    return rng.poisson(expected, size=(n_pixels, n_bins))
+
+
+def write_h3d_csv(
+    path, n_modules=500, n_bins=2000, bin_peak=None, n_pixels=121, metadata_lines=5, seed=0
+):
+    """
+    Writes a synthetic mask sweep of n_modules positions to path.
+
+    Parameters:
+    - bin_peak (int, optional): The photopeak bin, 90 % of n_bins by default.
+    - metadata_lines (int): The metadata rows before every module. The first 5 are
+      the stage_x_mm:, stage_y_mm:, stage_x_px:, stage_y_px: and height: rows read
+      by the dashboard, any further ones are extra_<i>: rows.
+
+    Returns:
+    - str: path.
+    """
+    rng = np.random.default_rng(seed)
+    if bin_peak is None:
+        bin_peak = int(0.9 * n_bins)
+    header = "H3D_Pixel," + ",".join(str(b) for b in range(n_bins)) + "\n"
+    with open(path, "w", newline="") as file:
+        file.write("Detector:,H3D synthetic,,\n")
+        for m in range(n_modules):
+            metadata = [
+                f"stage_x_mm:,{0.1 * m:.3f},,",
+                "stage_y_mm:,0.000,,",
+                f"stage_x_px:,{m},,",
+                "stage_y_px:,0,,",
+                "height:,22,,",
+            ]
+            metadata += [f"extra_{i}:,{m},," for i in range(5, metadata_lines)]
+            if metadata_lines:
+                file.write("\n".join(metadata[:metadata_lines]) + "\n")
+            file.write(header)
+            spectra = synthetic_spectra(rng, n_pixels, n_bins, bin_peak)
+            rows = np.column_stack([np.arange(1, n_pixels + 1), spectra])
+            np.savetxt(file, rows, fmt="%d", delimiter=",")
+            file.write(",,,\n")
+    return path
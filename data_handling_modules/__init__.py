@@ -1,7 +1,23 @@
+import logging
+
+from .instrumentation import StageTimer, IngestCounters, stage_timer, ingest_counters
 from .transform_df import TransformDf
 from .extract_module import ExtractModule
 from .extract_module_streamlit import ExtractModuleStreamlit
+from .h3d_scanner import H3DScanner
+from .spectrum_cube import SpectrumCube
+from .pixel_layout import PixelLayout
+from .sweep_cache import SweepCache
+from .count_table import CountTable
+from .lazy_sweep import LazySweep
+from .sweep_reducers import (
+    SweepReducer,
+    AverageSpectrumReducer,
+    CountSweepReducer,
+    SummedMapReducer,
+    MetadataReducer,
+    reduce_sweep,
+)
 
-
-
-
+# silent unless the application configures logging, see app.py
+logging.getLogger(__name__).addHandler(logging.NullHandler())
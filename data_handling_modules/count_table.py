@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from typing import List
+
+from .spectrum_cube import SpectrumCube
+from .transform_df import TransformDf
+from .instrumentation import stage_timer
+
+
+class CountTable:
+    """
+    Every per-pixel count of a sweep in one (count_type, module, x, y) array.
+
+    Built once per sweep and peak configuration, so the count sweeps of any set of
+    pixels are gathers from this table instead of loops over the module
+    DataFrames, and their cost no longer grows with the number of modules.
+
+    Parameters:
+    - table (np.ndarray): The float64 array with the shape (count_types, modules, x, y).
+    - count_types (list): The count type of every entry of the first axis.
+    """
+
+    COUNT_TYPES = (
+        "total_count",
+        "pixel_id",
+        "peak_count",
+        "non_peak_count",
+        "bin_max",
+        "peak_height",
+        "avg_neighbor_counts",
+        "leaking_ratio",
+    )
+
+    def __init__(self, table: np.ndarray, count_types: List[str]):
+        if table.ndim != 4 or table.shape[0] != len(count_types):
+            raise ValueError("table must have the shape (count_types, modules, x, y).")
+        self.table = table
+        self.count_types = list(count_types)
+        self._positions = {count_type: i for i, count_type in enumerate(self.count_types)}
+        _, self.n_modules, self.n_pixels_x, self.n_pixels_y = table.shape
+
+    @classmethod
+    @stage_timer.timed("count_table")
+    def from_cube(cls, cube: SpectrumCube, bin_peak=None, peak_halfwidth=25, peak_threshold=None):
+        """
+        The counts of every pixel of a SpectrumCube, from its cumulative sums.
+
+        Without bin_peak only total_count and pixel_id are available, and bin_max
+        and peak_height need peak_threshold, as in TransformDf.add_roi_stats_all.
+        """
+        grids = {
+            "total_count": cube.total_count(),
+            "pixel_id": np.broadcast_to(cube.pixel_id, cube.counts.shape[:-1]),
+        }
+        if bin_peak is not None:
+            grids.update(
+                TransformDf.calculate_roi_stats(
+                    cube.counts,
+                    bin_peak,
+                    peak_halfwidth,
+                    peak_threshold,
+                    cumulative=cube.cumulative_counts,
+                )
+            )
+            grids["avg_neighbor_counts"] = TransformDf.calculate_avg_neighbor_counts(
+                grids["peak_count"]
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                grids["leaking_ratio"] = grids["peak_count"] / grids["avg_neighbor_counts"]
+
+        count_types = [count_type for count_type in cls.COUNT_TYPES if count_type in grids]
+        table = np.empty((len(count_types),) + cube.counts.shape[:-1], dtype=np.float64)
+        for i, count_type in enumerate(count_types):
+            table[i] = grids[count_type]
+        return cls(table, count_types)
+
+    @classmethod
+    @stage_timer.timed("count_table")
+    def from_df_list(cls, df_transformed_list: List[pd.DataFrame], count_types=None):
+        """
+        The count columns of transformed DataFrames, e.g. of TransformDf.df_transformed_list.
+
+        All DataFrames must share the pixel layout of the first one. By default every
+        column of COUNT_TYPES the first DataFrame has is included.
+        """
+        if df_transformed_list == []:
+            raise ValueError("The input list is empty.")
+
+        df_first = df_transformed_list[0]
+        if count_types is None:
+            count_types = [c for c in cls.COUNT_TYPES if c in df_first.columns]
+        x_rows = df_first["x_index"].to_numpy() - 1
+        y_rows = df_first["y_index"].to_numpy() - 1
+        shape = (len(count_types), len(df_transformed_list), x_rows.max() + 1, y_rows.max() + 1)
+
+        table = np.full(shape, np.nan)
+        for i, count_type in enumerate(count_types):
+            values = np.stack([df[count_type].to_numpy() for df in df_transformed_list])
+            table[i][:, x_rows, y_rows] = values
+        return cls(table, count_types)
+
+    def __len__(self):
+        return self.n_modules
+
+    def __contains__(self, count_type):
+        return count_type in self._positions
+
+    def grid(self, count_type: str) -> np.ndarray:
+        """(modules, x, y) view of one count type."""
+        if count_type not in self._positions:
+            raise ValueError(f"{count_type} is not in this count table: {self.count_types}")
+        return self.table[self._positions[count_type]]
+
+    def pixel_sweeps(self, count_type: str, pixel_indices, start=None, stop=None) -> np.ndarray:
+        """(modules, pixels) counts of the (x_index, y_index) pixels over modules start to stop."""
+        x_rows, y_rows = np.asarray(pixel_indices).reshape(-1, 2).T - 1
+        return self.grid(count_type)[start:stop, x_rows, y_rows]
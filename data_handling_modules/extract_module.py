@@ -1,9 +1,17 @@
 import os
 import csv
+import functools
+import logging
 from typing import List, Tuple
 import pandas as pd
 import numpy as np
 
+from .h3d_scanner import H3DScanner
+from .sweep_cache import SweepCache
+from .instrumentation import stage_timer
+
+logger = logging.getLogger(__name__)
+
 
 class ExtractModule:
     """
@@ -14,6 +22,7 @@ class ExtractModule:
 
     Methods:
     - count_lines(csv_file): Counts the number of lines in the CSV file.
+    - iter_modules(): Yields the modules one at a time with their metadata.
     - find_line_number(csv_file, target_string): Finds the line numbers where the target string is found.
     - find_start_end_lines(target_string, extra_lines, module_number): Finds the start and end lines for extraction.
     - extract_module2df(module_number): Extracts the module data as a DataFrame.
@@ -21,19 +30,11 @@ class ExtractModule:
     """
 
     def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.cube = None  # the sweep of an .xlsx file, imported once into the SweepCache
         if csv_file.endswith(".xlsx"):
-            print("You entered a .xlsx file")
-            alternate_csv_file = csv_file.replace(".xlsx", ".csv")
-            if not os.path.exists(
-                alternate_csv_file
-            ):  # check if the file has been converted
-                print(f"Converting {csv_file} to {alternate_csv_file}...")
-                self.csv_file = self.convert_xlsx_to_csv(csv_file)
-            else:
-                print(f"Found {alternate_csv_file}, load that instead.")
-                self.csv_file = alternate_csv_file
-        else:
-            self.csv_file = csv_file
+            logger.info("You entered a .xlsx file, loading it through the sweep cache")
+            self.cube = self.load_xlsx(csv_file)
 
         # self.csv_file = csv_file # file path of the csv file from H3D software
         self.target_string = "H3D_Pixel"  # string to search for in the csv file
@@ -42,7 +43,7 @@ class ExtractModule:
         )
         self.n_pixels_x = 11  # number of pixels in x direction
         self.n_pixels_y = 11  # number of pixels in y direction
-        self.total_line_count = self.count_lines()  # this is not used, but nice to have
+        self._total_line_count = None  # counted on first use of total_line_count
         self.line_numbers = []
         self.start_line = None  # output of find_start_end_lines
         self.end_line = None  # output of find_start_end_lines
@@ -52,6 +53,21 @@ class ExtractModule:
         self.all_df_new = []  # output of transform_all_df
         self.N_DF = 0  # number of DataFrames in the list
 
+    @staticmethod
+    def load_xlsx(xlsx_file):
+        """
+        The SpectrumCube of an .xlsx sweep, read from the workbook only on a cache miss.
+
+        Memoised on the path and modification time, so repeated metadata lookups
+        neither hash nor load the workbook again.
+        """
+        return ExtractModule._load_xlsx(xlsx_file, os.path.getmtime(xlsx_file))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _load_xlsx(xlsx_file, mtime):
+        return SweepCache().load_or_parse(xlsx_file)
+
     @staticmethod
     def convert_xlsx_to_csv(input_xlsx_file):
         df = pd.read_excel(input_xlsx_file)
@@ -59,6 +75,13 @@ class ExtractModule:
         df.to_csv(output_csv_file, index=False)
         return output_csv_file
 
+    @property
+    def total_line_count(self):
+        """The number of lines in the CSV file, counted once on first access."""
+        if self._total_line_count is None:
+            self._total_line_count = self.count_lines()
+        return self._total_line_count
+
     def count_lines(self):
         """
         Counts the number of lines in the CSV file.
@@ -67,7 +90,7 @@ class ExtractModule:
             with open(self.csv_file, "r") as file:
                 return sum(1 for line in file)
         except:
-            print("File not found")
+            logger.error("File not found: %s", self.csv_file)
             return None
 
     def find_line_number(self, csv_file, target_string):
@@ -112,7 +135,7 @@ class ExtractModule:
             _ = self.find_line_number(self.csv_file, target_string)
 
         if type(module_number) != int:
-            print("Module number must be an integer")
+            logger.error("Module number must be an integer")
             return None
 
         self.extra_lines = extra_lines
@@ -132,6 +155,16 @@ class ExtractModule:
         Returns:
         - pandas.DataFrame: The extracted module data.
         """
+        if self.cube is not None:
+            # module_number is 1-based indexed
+            spectra = self.cube.module_pixels(module_number - 1)
+            self.dataframe = pd.DataFrame(
+                spectra.astype(np.int64),
+                index=pd.RangeIndex(1, self.cube.n_pixels + 1, name=self.target_string),
+                columns=self.cube.bin_labels,
+            )
+            return self.dataframe
+
         start_line, end_line = self.find_start_end_lines(
             self.target_string, module_number=module_number
         )
@@ -150,17 +183,37 @@ class ExtractModule:
     @property
     def number_of_bins(self):
         if self.dataframe is None:
-            print("DataFrame is not loaded yet. Please run extract_module2df() first.")
+            logger.warning("DataFrame is not loaded yet. Please run extract_module2df() first.")
             return None
         return len(self.dataframe.columns)
 
-    def extract_all_modules2df(self) -> List[pd.DataFrame]:
+    @stage_timer.timed("extract_modules", items=len)
+    def extract_all_modules2df(self, workers=1, executor="process") -> List[pd.DataFrame]:
         """
         Extracts all the module data from the CSV file as a DataFrame.
 
+        Parameters:
+        - workers (int): Parse the modules with a pool of this many workers if > 1.
+        - executor (str): "process" or "thread", the kind of pool used.
+
         Returns:
         - pandas.DataFrame: The extracted module data.
         """
+        if self.cube is not None:
+            for i in range(self.cube.n_modules):
+                self.all_df.append(self.extract_module2df(module_number=i + 1))
+            self.N_DF = len(self.all_df)
+            return self.all_df
+
+        if workers > 1:
+            scanner = H3DScanner(
+                self.csv_file, target_string=self.target_string, number_of_pixels=self.number_of_pixels
+            ).scan()
+            self.line_numbers = [n + 1 for n in scanner.line_numbers]  # 1-based like find_line_number
+            self.all_df.extend(scanner.read_modules(workers=workers, executor=executor))
+            self.N_DF = len(self.all_df)
+            return self.all_df
+
         if self.line_numbers == []:
             self.find_line_number(self.csv_file, self.target_string)
 
@@ -176,7 +229,30 @@ class ExtractModule:
     def number_of_modules(self):
         return len(self.all_df)
 
+    def iter_modules(self):
+        """
+        Yields (module_index, DataFrame, metadata) one module at a time in one pass.
+
+        Unlike extract_all_modules2df, the modules are not kept, see
+        H3DScanner.iter_modules and sweep_reducers for consuming them.
+        """
+        if self.cube is not None:
+            return self._iter_cube_modules()
+        scanner = H3DScanner(
+            self.csv_file, target_string=self.target_string, number_of_pixels=self.number_of_pixels
+        )
+        return scanner.iter_modules()
+
+    def _iter_cube_modules(self):
+        metadata = {}
+        for key, value in self.cube.metadata_items:
+            metadata.setdefault(key, []).append(value)
+        for m in range(self.cube.n_modules):
+            module_metadata = {key: values[m] for key, values in metadata.items() if m < len(values)}
+            yield m, self.extract_module2df(module_number=m + 1), module_metadata
+
     @staticmethod
+    @stage_timer.timed("metadata")
     def extract_metadata(file_path, search_pattern, occurrence):
         """
         Input:
@@ -193,10 +269,8 @@ class ExtractModule:
         4. Return the value if the desired occurrence is found.
         """
         if file_path.endswith(".xlsx"):
-            print("You entered a .xlsx file")
-            alternate_file_path = file_path.replace(".xlsx", ".csv")
-            print(f"Converting {file_path} to {alternate_file_path}...")
-            file_path = ExtractModule.convert_xlsx_to_csv(file_path)
+            values = ExtractModule.extract_metadata_list(file_path, search_pattern)
+            return values[occurrence] if occurrence < len(values) else None
 
         with open(file_path, "r") as csvfile:
             reader = csv.reader(csvfile)
@@ -217,6 +291,7 @@ class ExtractModule:
         return None  # return None if occurrence is not found
 
     @staticmethod
+    @stage_timer.timed("metadata", items=len)
     def extract_metadata_list(file_path, search_pattern):
         """
         Input:
@@ -234,10 +309,9 @@ class ExtractModule:
         """
 
         if file_path.endswith(".xlsx"):
-            print("You entered a .xlsx file")
-            alternate_file_path = file_path.replace(".xlsx", ".csv")
-            print(f"Converting {file_path} to {alternate_file_path}...")
-            file_path = ExtractModule.convert_xlsx_to_csv(file_path)
+            # the workbook is read once, later calls load the metadata from the cache
+            cube = ExtractModule.load_xlsx(file_path)
+            return cube.metadata_list(search_pattern) if cube is not None else []
 
         with open(file_path, "r") as csvfile:
             reader = csv.reader(csvfile)
@@ -1,10 +1,17 @@
 import os
 import csv
+import logging
 from typing import List, Tuple
 import pandas as pd
 import numpy as np
 import codecs
 
+from .h3d_scanner import H3DScanner
+from .spectrum_cube import SpectrumCube
+from .instrumentation import stage_timer
+
+logger = logging.getLogger(__name__)
+
 
 class ExtractModuleStreamlit:
 
@@ -18,6 +25,7 @@ class ExtractModuleStreamlit:
         self.dataframe = None  # output of extract_module2df
         self.df_list = []  # output of extract_all_modules2df
         self.data_source = data_source
+        self.scanner = None  # output of scan
 
     @staticmethod
     def find_line_number(csv_file, target_string, data_source):
@@ -32,7 +40,7 @@ class ExtractModuleStreamlit:
             for cell in row:
                 if target_string in cell:
                     line_numbers.append(row_index)
-        print(f"line_numbers: {line_numbers}")
+        logger.debug("line_numbers: %s", line_numbers)
         
         # If no lines with the target string are found, return an empty list
         # This will be handled by the calling function
@@ -41,38 +49,107 @@ class ExtractModuleStreamlit:
     @property
     def number_of_bins(self):
         if self.dataframe is None:
-            print("DataFrame is not loaded yet. Please run extract_module2df() first.")
+            logger.warning("DataFrame is not loaded yet. Please run extract_module2df() first.")
             return None
         return len(self.dataframe.columns)
 
-    def extract_all_modules2df(self) -> List[pd.DataFrame]:
-        self.line_numbers = ExtractModuleStreamlit.find_line_number(
-                self.csv_file, self.target_string, self.data_source)
+    def scan(self) -> H3DScanner:
+        """Index the module blocks and metadata with a single read of the file."""
+        self.scanner = H3DScanner(
+            self.csv_file, self.data_source, self.target_string, self.number_of_pixels
+        ).scan()
+        self.line_numbers = self.scanner.line_numbers
+        return self.scanner
+
+    @stage_timer.timed("extract_modules", items=len)
+    def extract_all_modules2df(self, workers=1, executor="process") -> List[pd.DataFrame]:
+        """
+        Extracts every module as a DataFrame, in file order.
+
+        With workers > 1 the module blocks are parsed concurrently by a pool of that
+        many processes (or threads with executor="thread"), see H3DScanner.read_modules.
+        """
+        if self.scanner is None:
+            self.scan()
 
         # If no modules are found, return an empty list
         if not self.line_numbers:
-            print(f"No modules found with target string '{self.target_string}' in the file.")
+            logger.warning("No modules found with target string '%s' in the file.", self.target_string)
             return []
 
+        if workers > 1:
+            logger.info("Extracting %d modules with %d workers", len(self.line_numbers), workers)
+            self.df_list = self.scanner.read_modules(workers=workers, executor=executor)
+            return self.df_list
+
         self.df_list = []  # reset the list
-        for i in range(len(self.line_numbers)):
-            print(f"Extracting module {i+1} of {len(self.line_numbers)}")
-            if self.data_source == "Uploaded file":
-                self.csv_file.seek(0)
-            df = pd.read_csv(self.csv_file,
-                             skiprows=self.line_numbers[i],
-                             nrows=self.number_of_pixels,
-                             index_col=self.target_string,
-                             header=0
-                             )
-            self.df_list.append(df)
+        with self.scanner.open() as file:
+            for i in range(len(self.line_numbers)):
+                logger.debug("Extracting module %d of %d", i + 1, len(self.line_numbers))
+                df = self.scanner.read_module(i, file)
+                self.df_list.append(df)
+        logger.info("Extracted %d modules", len(self.df_list))
         return self.df_list
-            
+
     @property
     def number_of_modules(self):
         return len(self.df_list)
 
+    @stage_timer.timed("extract_modules", items=len)
+    def extract_new_modules(self) -> List[pd.DataFrame]:
+        """
+        Live mode for sweeps still being acquired.
+
+        Parses only the module blocks completed since the last call, so earlier mask
+        positions are never parsed again. The first call parses every complete block.
+        The DataFrames are not kept in df_list, so a long acquisition is only held by
+        the caller.
+
+        Returns:
+        - list: The DataFrames of the new modules, empty if nothing was appended.
+        """
+        if self.scanner is None:
+            self.scanner = H3DScanner(
+                self.csv_file, self.data_source, self.target_string, self.number_of_pixels
+            )
+        new_modules = self.scanner.scan_appended()
+        self.line_numbers = self.scanner.line_numbers
+        if new_modules:
+            logger.info("Extracting modules %d to %d", new_modules.start + 1, new_modules.stop)
+        return self.scanner.read_modules(new_modules)
+
+    def iter_modules(self):
+        """
+        Yields (module_index, DataFrame, metadata) one module at a time in one pass.
+
+        The scan is filled in as the file is read, so metadata_list works afterwards.
+        """
+        self.scanner = H3DScanner(
+            self.csv_file, self.data_source, self.target_string, self.number_of_pixels
+        )
+        self.line_numbers = self.scanner.line_numbers
+        for module in self.scanner.iter_modules():
+            yield module
+        self.line_numbers = self.scanner.line_numbers
+
+    def extract_spectrum_cube(self, workers=1, executor="process") -> SpectrumCube:
+        """All modules as one SpectrumCube carrying the file metadata, or None if there are no modules."""
+        df_list = self.extract_all_modules2df(workers, executor)
+        if not df_list:
+            return None
+        cube = SpectrumCube.from_df_list(df_list, self.n_pixels_x, self.n_pixels_y)
+        cube.metadata_items = self.scanner.metadata_items
+        return cube
+
+    @stage_timer.timed("metadata", items=len)
+    def metadata_list(self, target_string):
+        """Metadata values from the single scan, same as extract_metadata_list."""
+        if self.scanner is None:
+            self.scan()
+        return self.scanner.metadata_list(target_string)
+
     @staticmethod
+    @stage_timer.timed("metadata", items=len)
     def extract_metadata_list(csv_file, target_string, data_source):
         """Extract metadata values from the csv file.
         """
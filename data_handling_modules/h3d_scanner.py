@@ -0,0 +1,394 @@
+import io
+import time
+import logging
+import bisect
+import csv
+import itertools
+import contextlib
+import warnings
+import concurrent.futures
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+from .instrumentation import stage_timer, ingest_counters
+
+logger = logging.getLogger(__name__)
+
+
+class H3DScanner:
+    """
+    Single-pass index of a CSV file from H3D software.
+
+    One streaming read of the file records the byte offset of every module
+    block (the row holding the target string) and every metadata cell
+    (``stage_x_mm:``, ``height:``, ...) together with the value to its right.
+    Module blocks are then parsed directly from their offsets.
+
+    Parameters:
+    - csv_file (str or file-like): The file path, or the uploaded file object.
+    - data_source (str): "Uploaded file" if csv_file is a file object.
+    - target_string (str): The header cell that marks the start of a module.
+    - number_of_pixels (int): The number of rows in each module block.
+    """
+
+    def __init__(
+        self,
+        csv_file,
+        data_source=None,
+        target_string="H3D_Pixel",
+        number_of_pixels=121,
+    ):
+        self.csv_file = csv_file
+        self.data_source = data_source
+        self.target_string = target_string
+        self.number_of_pixels = number_of_pixels
+        self.module_offsets = []  # byte offset of each module header row
+        self.module_sizes = []  # byte length of each module block, header row included
+        self.line_numbers = []  # 0-based line number of each module header row
+        self.metadata_items = []  # (key, value) pairs in file order
+        self._metadata_values = {}  # the same values grouped by key, kept up to date
+        self.n_bins = None  # number of bin columns in the first module header
+        self.scanned_offset = 0  # byte offset up to which the scan is complete
+        self.scanned_lines = 0  # number of lines up to scanned_offset
+
+    def open(self):
+        """Open the source in binary mode, leaving uploaded files open on exit."""
+        if self.data_source == "Uploaded file":
+            self.csv_file.seek(0)  # reset the file pointer
+            return contextlib.nullcontext(self.csv_file)
+        return open(self.csv_file, "rb")
+
+    @staticmethod
+    def split_row(line: bytes) -> List[str]:
+        """Split one raw CSV line into its cells."""
+        return next(csv.reader([line.decode("utf-8")]), [])
+
+    @stage_timer.timed("scan", items=lambda scanner: scanner.number_of_modules)
+    def scan(self):
+        """
+        Reads the file once and indexes the module blocks and metadata.
+
+        Rows inside a module block are skipped without being tokenized, so the
+        cost of a scan is one pass over the bytes of the file.
+        """
+        start = time.perf_counter()
+        for _ in self._scan(collect_blocks=False):
+            pass
+        seconds = time.perf_counter() - start
+        ingest_counters.add(
+            files_scanned=1, bytes_scanned=self.scanned_offset, scan_seconds=seconds
+        )
+        logger.debug(
+            "Scanned %d modules, %d bytes in %.3f s", self.number_of_modules, self.scanned_offset, seconds
+        )
+        return self
+
+    def _scan(self, collect_blocks=False, follow=False):
+        """
+        The single pass behind scan, scan_appended and iter_modules.
+
+        If collect_blocks, yields (module_index, block) as soon as the raw bytes of a
+        module block (header row included) are complete. If follow, the pass resumes
+        at scanned_offset and stops before a line or module block that is still being
+        written, so the next call picks it up once it is complete.
+        """
+        target = self.target_string.encode("utf-8")
+        if follow:
+            # forget a block that was still incomplete at the end of the last pass
+            n_complete = bisect.bisect_left(self.module_offsets, self.scanned_offset)
+            del self.module_offsets[n_complete:], self.module_sizes[n_complete:]
+            del self.line_numbers[n_complete:]
+        else:
+            self.module_offsets, self.module_sizes, self.line_numbers = [], [], []
+            self.metadata_items, self._metadata_values = [], {}
+            self.scanned_offset, self.scanned_lines = 0, 0
+
+        offset = self.scanned_offset
+        rows_left = 0  # rows remaining in the current module block
+        block = []
+        with self.open() as file:
+            file.seek(offset)
+            for line_number, line in enumerate(file, start=self.scanned_lines):
+                if follow and not line.endswith(b"\n"):
+                    break  # the line is still being written
+                if target in line:
+                    if collect_blocks and rows_left:  # previous block was cut short
+                        yield self.number_of_modules - 1, b"".join(block)
+                    self.module_offsets.append(offset)
+                    self.module_sizes.append(len(line))
+                    self.line_numbers.append(line_number)
+                    if self.n_bins is None:
+                        self.n_bins = len(self.split_row(line)) - 1
+                    rows_left = self.number_of_pixels
+                    block = [line]
+                elif rows_left:
+                    rows_left -= 1
+                    self.module_sizes[-1] += len(line)
+                    if collect_blocks:
+                        block.append(line)
+                        if rows_left == 0:
+                            yield self.number_of_modules - 1, b"".join(block)
+                elif b":" in line:
+                    row = self.split_row(line)
+                    for c, cell in enumerate(row):
+                        if ":" in cell:
+                            # None if there is no value to the right
+                            value = row[c + 1] if c < len(row) - 1 else None
+                            self.metadata_items.append((cell, value))
+                            self._metadata_values.setdefault(cell, []).append(value)
+                offset += len(line)
+                if not rows_left:  # everything up to here is complete
+                    self.scanned_offset, self.scanned_lines = offset, line_number + 1
+        if follow and rows_left:  # the block is still being written
+            self.module_offsets.pop(), self.module_sizes.pop(), self.line_numbers.pop()
+        elif collect_blocks and rows_left:  # file ends inside a block
+            yield self.number_of_modules - 1, b"".join(block)
+
+    @stage_timer.timed("scan_appended", items=len)
+    def scan_appended(self) -> range:
+        """
+        Live mode: continues the scan where the previous one stopped.
+
+        Only the bytes appended since the last scan are read, and a module block is
+        indexed once all its rows are written. A final line without a line break is
+        treated as still being written.
+
+        Returns:
+        - range: The indices of the modules completed since the last scan.
+        """
+        first_new = bisect.bisect_left(self.module_offsets, self.scanned_offset)
+        start, start_offset = time.perf_counter(), self.scanned_offset
+        for _ in self._scan(follow=True):
+            pass
+        ingest_counters.add(
+            bytes_scanned=self.scanned_offset - start_offset,
+            scan_seconds=time.perf_counter() - start,
+        )
+        if self.number_of_modules > first_new:
+            logger.debug("Found modules %d to %d", first_new + 1, self.number_of_modules)
+        return range(first_new, self.number_of_modules)
+
+    def iter_modules(self):
+        """
+        Yields (module_index, DataFrame, metadata) one module at a time in one pass.
+
+        Only the current and the previous module block are held in memory, so files
+        larger than RAM can be processed. metadata maps every metadata key to its
+        module_index-th value in the file. A module is yielded once the next module
+        block is complete (or the file ends), so metadata written after its block is
+        included.
+        """
+        pending = None
+        for module_index, block in self._scan(collect_blocks=True):
+            if pending is not None:
+                yield self._module_with_metadata(*pending)
+            pending = (module_index, block)
+        if pending is not None:
+            yield self._module_with_metadata(*pending)
+
+    def _module_with_metadata(self, module_index, block):
+        metadata = {
+            key: values[module_index]
+            for key, values in self._metadata_values.items()
+            if module_index < len(values)
+        }
+        return module_index, self.parse_block(block), metadata
+
+    @property
+    def number_of_modules(self):
+        return len(self.module_offsets)
+
+    @property
+    def metadata(self) -> Dict[str, List[str]]:
+        """All metadata values found in the file, grouped by their key cell."""
+        return {key: list(values) for key, values in self._metadata_values.items()}
+
+    def metadata_list(self, search_pattern: str) -> List[str]:
+        """Values to the right of every metadata cell containing search_pattern."""
+        return [
+            value for key, value in self.metadata_items if search_pattern in key
+        ]
+
+    @staticmethod
+    def decode_counts(block: bytes, number_of_pixels=121):
+        """
+        Decodes one module block straight into an int64 array, without pandas.
+
+        The rows after the header are converted in bulk by np.fromstring, which is
+        much faster than pd.read_csv with its type inference and index parsing.
+
+        Returns:
+        - tuple: (bin_labels, pixel_ids, counts) with counts of shape (rows, bins),
+          or None if the block is not a plain integer matrix (empty cells, floats,
+          ragged rows), in which case the pandas parser should be used.
+        """
+        header, _, body = block.partition(b"\n")
+        body = body.rstrip().replace(b"\r", b"")
+        if not body:
+            return None
+        labels = H3DScanner.split_row(header.rstrip(b"\r"))
+        n_columns = len(labels)
+        if body.count(b"\n") + 1 > number_of_pixels:  # like nrows in read_csv
+            body = b"\n".join(body.split(b"\n")[:number_of_pixels])
+        with warnings.catch_warnings():
+            # fromstring warns and stops at the first cell it cannot convert
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(body.replace(b"\n", b","), dtype=np.int64, sep=",")
+        n_rows = body.count(b"\n") + 1
+        if values.size != n_rows * n_columns:
+            return None
+        values = values.reshape(n_rows, n_columns)
+        return labels[1:], values[:, 0], values[:, 1:]
+
+    @staticmethod
+    def decode_block(block: bytes, target_string="H3D_Pixel", number_of_pixels=121) -> pd.DataFrame:
+        """
+        Parses the raw bytes of one module block, header row included.
+
+        Uses decode_counts, falling back to pd.read_csv on malformed blocks. A
+        staticmethod so that it can be sent to the workers of a process pool.
+        """
+        decoded = H3DScanner.decode_counts(block, number_of_pixels)
+        if decoded is not None:
+            bin_labels, pixel_ids, counts = decoded
+            # int64 like pd.read_csv, so both paths give identical DataFrames
+            return pd.DataFrame(
+                counts,
+                index=pd.Index(pixel_ids, name=target_string),
+                columns=pd.Index(bin_labels, dtype=object),
+            )
+        logger.debug("Block is not a plain integer matrix, parsing it with pandas")
+        ingest_counters.add(fallback_parses=1)  # not seen from process pool workers
+        return pd.read_csv(
+            io.BytesIO(block),
+            nrows=number_of_pixels,
+            index_col=target_string,
+            header=0,
+        )
+
+    def parse_block(self, block: bytes) -> pd.DataFrame:
+        """Parses the raw bytes of one module block, header row included."""
+        start = time.perf_counter()
+        df = self.decode_block(block, self.target_string, self.number_of_pixels)
+        ingest_counters.add(
+            modules_parsed=1, bytes_read=len(block), parse_seconds=time.perf_counter() - start
+        )
+        return df
+
+    @stage_timer.timed("parse_module")
+    def read_module(self, module_index: int, file=None) -> pd.DataFrame:
+        """
+        Parses one module block, reading only its byte range.
+
+        Parameters:
+        - module_index (int): 0-based index of the module.
+        - file (file-like, optional): An open binary handle from open(), reused
+          when reading many modules.
+
+        Returns:
+        - pandas.DataFrame: The module data indexed by the target string column.
+        """
+        with self.open() if file is None else contextlib.nullcontext(file) as file:
+            file.seek(self.module_offsets[module_index])
+            return self.parse_block(file.read(self.module_sizes[module_index]))
+
+    @stage_timer.timed("parse_module")
+    def read_counts(self, module_index: int, file=None, n_pixels_x=11, n_pixels_y=11) -> np.ndarray:
+        """
+        (n_pixels_x, n_pixels_y, bins) int32 counts of one module, rows in pixel_id order.
+
+        Skips the DataFrame entirely when the block decodes with decode_counts.
+        Raises ValueError if the block lacks pixel rows or has empty cells, e.g. a
+        last block still being written, instead of casting the gaps to int32.
+        """
+        with self.open() if file is None else contextlib.nullcontext(file) as file:
+            file.seek(self.module_offsets[module_index])
+            block = file.read(self.module_sizes[module_index])
+        n_pixels = n_pixels_x * n_pixels_y
+        start = time.perf_counter()
+        decoded = self.decode_counts(block, self.number_of_pixels)
+        if decoded is not None:
+            _, pixel_ids, counts = decoded
+            if np.array_equal(pixel_ids, np.arange(1, n_pixels + 1)):
+                ingest_counters.add(
+                    modules_parsed=1,
+                    bytes_read=len(block),
+                    parse_seconds=time.perf_counter() - start,
+                )
+                return self.narrow_counts(counts, module_index).reshape(n_pixels_x, n_pixels_y, -1)
+        # unordered or malformed block, align the rows on the pixel number
+        df = self.parse_block(block).reindex(pd.RangeIndex(1, n_pixels + 1))
+        if df.isna().to_numpy().any():
+            raise ValueError(
+                f"Module {module_index} is incomplete: missing pixel rows or empty cells."
+            )
+        counts = self.narrow_counts(df.to_numpy(), module_index)
+        return counts.reshape(n_pixels_x, n_pixels_y, -1)
+
+    @staticmethod
+    def narrow_counts(counts: np.ndarray, module_index: int) -> np.ndarray:
+        """counts as int32, raising ValueError if any count does not fit."""
+        int32 = np.iinfo(np.int32)
+        if counts.size and (counts.min() < int32.min or counts.max() > int32.max):
+            raise ValueError(f"Module {module_index} has counts outside the int32 range.")
+        return counts.astype(np.int32)
+
+    def read_blocks(self, module_indices=None, file=None):
+        """Yields the raw bytes of the module blocks in module_indices, all by default."""
+        if module_indices is None:
+            module_indices = range(self.number_of_modules)
+        if file is None:
+            with self.open() as file:
+                yield from self.read_blocks(module_indices, file)
+            return
+
+        for m in module_indices:
+            file.seek(self.module_offsets[m])
+            yield file.read(self.module_sizes[m])
+
+    @stage_timer.timed("parse_modules", items=len)
+    def read_modules(self, module_indices=None, workers=1, executor="process") -> List[pd.DataFrame]:
+        """
+        Parses many module blocks, in parallel if workers > 1.
+
+        The blocks are independent once the scan has found their byte ranges, so they
+        are read sequentially and decoded concurrently. The output is in the order of
+        module_indices either way.
+
+        Parameters:
+        - module_indices (iterable, optional): 0-based module indices, all by default.
+        - workers (int): The number of worker processes or threads. 1 parses serially.
+        - executor (str): "process" for a process pool, "thread" for a thread pool.
+
+        Returns:
+        - list: The module DataFrames indexed by the target string column.
+        """
+        blocks = self.read_blocks(module_indices)
+        if workers <= 1:
+            return [self.parse_block(block) for block in blocks]
+
+        if executor == "process":
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        elif executor == "thread":
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f"Unknown executor {executor!r}, use 'process' or 'thread'.")
+        blocks = list(blocks)
+        start = time.perf_counter()
+        with pool:
+            df_list = list(
+                pool.map(
+                    self.decode_block,
+                    blocks,
+                    itertools.repeat(self.target_string, len(blocks)),
+                    itertools.repeat(self.number_of_pixels, len(blocks)),
+                    chunksize=max(1, len(blocks) // (4 * workers)),
+                )
+            )
+        ingest_counters.add(
+            modules_parsed=len(blocks),
+            bytes_read=sum(len(block) for block in blocks),
+            parse_seconds=time.perf_counter() - start,
+        )
+        return df_list
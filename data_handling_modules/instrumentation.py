@@ -0,0 +1,196 @@
+import json
+import time
+import functools
+import threading
+import tracemalloc
+import contextlib
+import collections
+import pandas as pd
+
+
+class StageTimer:
+    """
+    Records the wall time, peak memory and item counts of named pipeline stages.
+
+    Stages are recorded with the stage() context manager or the timed() decorator,
+    one record per call. Records are kept per thread, so every Streamlit session
+    (each runs its script in its own thread) sees only its own stages.
+
+    The peak memory is only measured while tracemalloc is tracing, see
+    trace_memory(), because tracing slows the whole process down. Nested stages
+    each report the peak reached while they ran, relative to their start.
+
+    Unlike the records, tracemalloc is global to the process: tracing is on or
+    off for every session at once, and a stage resets the one peak counter that
+    all threads share. Turn tracing on once at startup rather than per session,
+    and expect the peaks of stages running concurrently in other sessions to be
+    under-reported.
+
+    Parameters:
+    - max_records (int): The number of records kept per thread, oldest dropped first.
+    """
+
+    def __init__(self, max_records=10000):
+        self.max_records = max_records
+        self.enabled = True
+        self._local = threading.local()
+
+    @property
+    def records(self) -> collections.deque:
+        if not hasattr(self._local, "records"):
+            self._local.records = collections.deque(maxlen=self.max_records)
+            self._local.open_stages = []  # peak memory seen by the enclosing stages
+        return self._local.records
+
+    @staticmethod
+    def trace_memory(enable=True):
+        """
+        Starts (or stops) tracemalloc so that stages record their peak memory.
+
+        A process-wide setting, see the class docstring. app.py calls it once
+        when the server is started with H3D_TRACE_MEMORY=1.
+        """
+        if enable and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enable and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @staticmethod
+    def tracing_memory() -> bool:
+        """True if stages currently record their peak memory."""
+        return tracemalloc.is_tracing()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items=None):
+        """
+        Times the block as one call of stage name.
+
+        Yields the record, so the block can set record["items"] once it knows the
+        number of items (modules, pixels, traces, ...) it handled.
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        records = self.records
+        open_stages = self._local.open_stages
+        record = {"stage": name, "items": items, "seconds": None, "peak_memory_mb": None}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_memory, peak = tracemalloc.get_traced_memory()
+            if open_stages:  # keep the peak reached so far for the enclosing stage
+                open_stages[-1] = max(open_stages[-1], peak)
+            tracemalloc.reset_peak()
+        open_stages.append(0)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            peak = open_stages.pop()
+            if tracing and tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                record["peak_memory_mb"] = (peak - start_memory) / 1e6
+                if open_stages:
+                    open_stages[-1] = max(open_stages[-1], peak)
+            records.append(record)
+
+    def timed(self, name: str = None, items=None):
+        """
+        Decorator recording every call of the function as stage name.
+
+        Parameters:
+        - name (str, optional): The stage name, the function's qualified name by default.
+        - items (callable, optional): Maps the return value to the item count, e.g. len.
+        """
+
+        def decorator(function):
+            stage_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.stage(stage_name) as record:
+                    result = function(*args, **kwargs)
+                    if items is not None and result is not None:
+                        record["items"] = items(result)
+                    return result
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        """Forgets the records of this thread, e.g. at the start of a rerun."""
+        self.records.clear()
+
+    def summary(self) -> pd.DataFrame:
+        """Calls, total seconds, largest peak memory and total items of every stage, in first-call order."""
+        columns = ["stage", "calls", "seconds", "peak_memory_mb", "items"]
+        if not self.records:
+            return pd.DataFrame(columns=columns).set_index("stage")
+        records = pd.DataFrame(list(self.records))
+        records["items"] = pd.to_numeric(records["items"])
+        summary = records.groupby("stage", sort=False).agg(
+            calls=("seconds", "size"),
+            seconds=("seconds", "sum"),
+            peak_memory_mb=("peak_memory_mb", "max"),
+            items=("items", lambda items: items.sum(min_count=1)),  # NaN if never counted
+        )
+        return summary[columns[1:]]
+
+    def dump(self, path: str, **context):
+        """
+        Appends the records of this thread to path as JSON lines.
+
+        Every line carries the keyword arguments in context, e.g. the file name of
+        the sweep, and the time of the dump.
+        """
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(path, "a") as file:
+            for record in self.records:
+                file.write(json.dumps({"time": timestamp, **context, **record}, default=str) + "\n")
+
+
+class IngestCounters:
+    """
+    Process-wide running totals of the ingest path, for production monitoring.
+
+    Unlike the StageTimer records these are never reset by a rerun and are shared
+    by every session. Updating them takes a lock and a few additions, so they are
+    always on.
+    """
+
+    FIELDS = (
+        "files_scanned",
+        "bytes_scanned",
+        "scan_seconds",
+        "modules_parsed",
+        "bytes_read",
+        "parse_seconds",
+        "fallback_parses",  # blocks the fast decoder rejected, parsed by pandas
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, **deltas):
+        """Adds deltas to the named counters, e.g. add(modules_parsed=1, bytes_read=n)."""
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counts[name] += delta
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.FIELDS, 0)
+
+
+# shared by data_handling_modules and plotting_modules
+stage_timer = StageTimer()
+ingest_counters = IngestCounters()
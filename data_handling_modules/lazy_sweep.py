@@ -0,0 +1,117 @@
+import threading
+import collections
+
+from .spectrum_cube import SpectrumCube
+from .transform_df import TransformDf
+from .count_table import CountTable
+from .instrumentation import stage_timer
+
+
+class LazySweep:
+    """
+    The transformed module DataFrames of a sweep, built only when a module is viewed.
+
+    Behaves like the df_transformed_list of TransformDf (len, indexing, slicing,
+    iteration), but a module is transformed, and its peak statistics added, on
+    first access. The most recently viewed modules are kept in an LRU cache, so
+    moving the module slider back and forth costs nothing and opening a sweep no
+    longer scales with its length. Whole-sweep views should read count_table instead,
+    see create_count_sweep.
+
+    Parameters:
+    - cube (SpectrumCube): The sweep, e.g. memory-mapped from a SweepCache.
+    - bin_peak (int, optional): The peak bin. Without it only the peak-independent
+      columns are added.
+    - peak_halfwidth (int): Half the width of the ROI around the peak bin.
+    - peak_threshold (int, optional): Peak heights below this set bin_max to the ROI start.
+    - cache_size (int): The number of transformed modules kept.
+    """
+
+    def __init__(
+        self,
+        cube: SpectrumCube,
+        bin_peak=None,
+        peak_halfwidth=25,
+        peak_threshold=None,
+        cache_size=32,
+    ):
+        self.cube = cube
+        self.bin_peak = bin_peak
+        self.peak_halfwidth = peak_halfwidth
+        self.peak_threshold = peak_threshold
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()  # instances are shared between sessions
+        self.hits = 0
+        self.misses = 0
+        self._count_table = None
+
+    @property
+    def data_version(self):
+        """Changes with the cube and the peak settings, None if the cube has no data_version."""
+        if self.cube.data_version is None:
+            return None
+        return (
+            f"{self.cube.data_version}"
+            f"|peak={self.bin_peak},{self.peak_halfwidth},{self.peak_threshold}"
+        )
+
+    def __len__(self):
+        return self.cube.n_modules
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.module(m) for m in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"module {index} out of range for {len(self)} modules")
+        return self.module(index)
+
+    def __iter__(self):
+        for m in range(len(self)):
+            yield self.module(m)
+
+    def module(self, module_index: int):
+        """The transformed DataFrame of one module, from the LRU cache if viewed recently."""
+        with self._lock:
+            if module_index in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(module_index)
+                return self._cache[module_index]
+            self.misses += 1
+
+        df_new = self.transform_module(module_index)
+        with self._lock:
+            self._cache[module_index] = df_new
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)  # least recently viewed
+        return df_new
+
+    @stage_timer.timed("lazy_sweep.transform_module")
+    def transform_module(self, module_index: int):
+        """Same columns as transform_all_df, add_roi_stats_all and add_leaking_ratio_all."""
+        TD = TransformDf(n_pixels_x=self.cube.n_pixels_x, n_pixels_y=self.cube.n_pixels_y)
+        TD.df_transformed_list = [TD.transform_df(None, self.cube.module_pixels(module_index))]
+        if self.bin_peak is not None:
+            TD.add_roi_stats_all(self.bin_peak, self.peak_halfwidth, self.peak_threshold)
+            TD.add_leaking_ratio_all("peak_count")
+        return TD.df_transformed_list[0]
+
+    @property
+    def count_table(self) -> CountTable:
+        """The counts of every pixel and module for these peak settings, built on first use."""
+        with self._lock:
+            if self._count_table is None:
+                self._count_table = CountTable.from_cube(
+                    self.cube, self.bin_peak, self.peak_halfwidth, self.peak_threshold
+                )
+            return self._count_table
+
+    def cache_info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+        }
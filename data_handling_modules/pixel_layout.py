@@ -0,0 +1,64 @@
+import functools
+import numpy as np
+import pandas as pd
+
+
+class PixelLayout:
+    """
+    Pixel numbering of a detector tile, computed once per geometry.
+
+    Pixels are numbered row by row along y: pixel_id = (x_index - 1) * n_pixels_y
+    + y_index, with x_index and y_index starting at 1. The grids have the shape
+    (n_pixels_x, n_pixels_y) and frame has one row per pixel_id. Everything is
+    read-only because instances are shared through get().
+
+    Parameters:
+    - n_pixels_x (int): The number of pixels in the x direction.
+    - n_pixels_y (int): The number of pixels in the y direction.
+    """
+
+    def __init__(self, n_pixels_x=11, n_pixels_y=11):
+        self.n_pixels_x = n_pixels_x
+        self.n_pixels_y = n_pixels_y
+        self.n_pixels = n_pixels_x * n_pixels_y
+
+        self.x_index, self.y_index = np.meshgrid(
+            np.arange(1, n_pixels_x + 1), np.arange(1, n_pixels_y + 1), indexing="ij"
+        )
+        self.pixel_id = (self.x_index - 1) * n_pixels_y + self.y_index
+        self.is_edge = (
+            (self.x_index == 1)
+            | (self.x_index == n_pixels_x)
+            | (self.y_index == 1)
+            | (self.y_index == n_pixels_y)
+        )
+        # number of the 4 nearest neighbors (left, right, down, up) inside the tile
+        self.n_neighbors = 4 - (
+            (self.x_index == 1).astype(int)
+            + (self.x_index == n_pixels_x)
+            + (self.y_index == 1)
+            + (self.y_index == n_pixels_y)
+        )
+        for grid in (
+            self.x_index,
+            self.y_index,
+            self.pixel_id,
+            self.is_edge,
+            self.n_neighbors,
+        ):
+            grid.setflags(write=False)
+
+        self.frame = pd.DataFrame(
+            {
+                "x_index": self.x_index.ravel(),
+                "y_index": self.y_index.ravel(),
+                "pixel_id": self.pixel_id.ravel(),
+            },
+            index=pd.RangeIndex(1, self.n_pixels + 1),
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get(n_pixels_x=11, n_pixels_y=11) -> "PixelLayout":
+        """The shared layout for this geometry, built on first use."""
+        return PixelLayout(n_pixels_x, n_pixels_y)
@@ -0,0 +1,243 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import List
+
+from .pixel_layout import PixelLayout
+from .instrumentation import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+class SpectrumCube:
+    """
+    The spectra of a whole sweep in one contiguous integer array.
+
+    counts has the shape (modules, n_pixels_x, n_pixels_y, bins), so
+    counts[m, x_index - 1, y_index - 1] is the spectrum of one pixel at mask
+    position m. The pixel metadata (x_index, y_index, pixel_id, is_edge) is kept
+    alongside as (n_pixels_x, n_pixels_y) grids.
+
+    Parameters:
+    - counts (np.ndarray): The 4-D array of counts.
+    - bin_labels (list, optional): The bin column labels from the H3D header.
+    - metadata_items (list, optional): The (key, value) metadata pairs of the
+      source file in file order, as collected by H3DScanner.
+    - data_version (str, optional): A token that changes whenever the counts do,
+      e.g. the SweepCache key. Cheap to hash, unlike the counts themselves.
+    - cumulative_counts (np.ndarray, optional): Precomputed running sums of counts,
+      see the cumulative_counts property. Computed on first use if not given.
+    """
+
+    def __init__(
+        self,
+        counts: np.ndarray,
+        bin_labels=None,
+        metadata_items=None,
+        data_version=None,
+        cumulative_counts=None,
+    ):
+        if counts.ndim != 4:
+            raise ValueError("counts must have the shape (modules, x, y, bins).")
+        self.counts = counts
+        self.bin_labels = bin_labels
+        self.metadata_items = metadata_items if metadata_items is not None else []
+        self.data_version = data_version
+        self._cumulative_counts = cumulative_counts
+        self.n_modules, self.n_pixels_x, self.n_pixels_y, self.n_bins = counts.shape
+
+        # pixel metadata on the (x, y) grid, same numbering as TransformDf
+        self.layout = PixelLayout.get(self.n_pixels_x, self.n_pixels_y)
+        self.x_index = self.layout.x_index
+        self.y_index = self.layout.y_index
+        self.pixel_id = self.layout.pixel_id
+        self.is_edge = self.layout.is_edge
+
+    @classmethod
+    def from_df_list(
+        cls,
+        extracted_df_list: List[pd.DataFrame],
+        n_pixels_x=11,
+        n_pixels_y=11,
+        dtype=np.int32,
+    ):
+        """
+        Stacks the extracted module DataFrames into a single cube.
+
+        Each DataFrame is indexed by H3D_Pixel (1 to n_pixels_x * n_pixels_y)
+        with one column per bin, as returned by extract_all_modules2df. Raises
+        ValueError if a DataFrame is missing pixels, has empty cells or a different
+        number of bins, instead of casting the gaps to the integer dtype.
+        """
+        if extracted_df_list == []:
+            raise ValueError("The input list is empty.")
+
+        n_pixels = n_pixels_x * n_pixels_y
+        pixel_ids = pd.RangeIndex(1, n_pixels + 1)
+        n_bins = extracted_df_list[0].shape[1]
+
+        counts = np.empty((len(extracted_df_list), n_pixels, n_bins), dtype=dtype)
+        for m, df in enumerate(extracted_df_list):
+            if not df.index.equals(pixel_ids):
+                df = df.reindex(pixel_ids)  # align rows on the pixel number
+            values = df.to_numpy()
+            if values.shape != (n_pixels, n_bins):
+                raise ValueError(
+                    f"Module {m} has {values.shape[1]} bins, expected {n_bins} like module 0."
+                )
+            if pd.isna(values).any():
+                raise ValueError(f"Module {m} has missing pixels or empty cells.")
+            counts[m] = values
+
+        counts = counts.reshape(len(extracted_df_list), n_pixels_x, n_pixels_y, n_bins)
+        return cls(counts, bin_labels=list(extracted_df_list[0].columns))
+
+    @classmethod
+    def from_sheet(
+        cls,
+        sheet: pd.DataFrame,
+        target_string="H3D_Pixel",
+        n_pixels_x=11,
+        n_pixels_y=11,
+        dtype=np.int32,
+    ):
+        """
+        The modules and metadata of an H3D sheet already read into memory.
+
+        sheet holds the raw cells, e.g. pd.read_excel(file, header=None). Module
+        blocks start at rows whose first cell is target_string, and every other cell
+        containing ":" is a metadata key with the value to its right, as in H3DScanner.
+        An incomplete last block is left out, any other one raises ValueError.
+        Returns None if the sheet has no complete modules.
+        """
+        n_pixels = n_pixels_x * n_pixels_y
+        cells = sheet.to_numpy(dtype=object)
+        header_rows = np.flatnonzero(cells[:, 0] == target_string)
+        if len(header_rows) == 0:
+            return None
+
+        in_block = np.zeros(len(cells), dtype=bool)
+        for row in header_rows:
+            in_block[row : row + n_pixels + 1] = True
+        metadata_items = []
+        for row in np.flatnonzero(~in_block):
+            for c, cell in enumerate(cells[row]):
+                if isinstance(cell, str) and ":" in cell:
+                    value = cells[row, c + 1] if c < cells.shape[1] - 1 else None
+                    metadata_items.append((cell, None if pd.isna(value) else str(value)))
+
+        header = cells[header_rows[0]]
+        n_bins = int(pd.notna(header[1:]).sum())
+        bin_labels = [str(b) for b in header[1 : n_bins + 1]]
+        pixel_ids = pd.RangeIndex(1, n_pixels + 1)
+        counts = np.empty((len(header_rows), n_pixels, n_bins), dtype=dtype)
+        for m, row in enumerate(header_rows):
+            rows = cells[row + 1 : row + n_pixels + 1]
+            rows = rows[pd.notna(rows[:, 0])]  # a pixel row cut off before its number
+            block = pd.DataFrame(rows[:, 1 : n_bins + 1], index=rows[:, 0].astype(np.int64))
+            if not block.index.equals(pixel_ids):
+                block = block.reindex(pixel_ids)  # align rows on the pixel number
+            values = block.to_numpy()
+            if pd.isna(values).any():
+                if m < len(header_rows) - 1:
+                    raise ValueError(f"Module {m} has missing pixels or empty cells.")
+                # like SweepCache.convert, a last block still being written is left out
+                logger.warning("Leaving out the incomplete last module %d", m)
+                header_rows = header_rows[:m]
+                counts = counts[:m]
+                break
+            counts[m] = values.astype(dtype)
+        if len(header_rows) == 0:
+            return None
+
+        counts = counts.reshape(len(header_rows), n_pixels_x, n_pixels_y, n_bins)
+        return cls(counts, bin_labels=bin_labels, metadata_items=metadata_items)
+
+    def __len__(self):
+        return self.n_modules
+
+    @property
+    def n_pixels(self):
+        return self.layout.n_pixels
+
+    def select_modules(self, start: int, stop: int = None) -> "SpectrumCube":
+        """A cube viewing modules start to stop of this one, with the same metadata."""
+        data_version = None
+        if self.data_version is not None:
+            data_version = f"{self.data_version}[{start}:{stop}]"
+        cumulative_counts = None
+        if self._cumulative_counts is not None:
+            cumulative_counts = self._cumulative_counts[start:stop]
+        return SpectrumCube(
+            self.counts[start:stop],
+            self.bin_labels,
+            self.metadata_items,
+            data_version,
+            cumulative_counts,
+        )
+
+    @stage_timer.timed("metadata", items=len)
+    def metadata_list(self, search_pattern: str) -> List[str]:
+        """Values to the right of every metadata cell containing search_pattern."""
+        return [
+            value for key, value in self.metadata_items if search_pattern in key
+        ]
+
+    def module_pixels(self, module_index: int) -> np.ndarray:
+        """(pixels, bins) view of one module, rows ordered by pixel_id."""
+        return self.counts[module_index].reshape(self.n_pixels, self.n_bins)
+
+    def pixel_spectrum(self, module_index: int, x_index: int, y_index: int):
+        """Spectrum of one pixel at one mask position."""
+        return self.counts[module_index, x_index - 1, y_index - 1]
+
+    def pixel_sweep(self, x_index: int, y_index: int) -> np.ndarray:
+        """(modules, bins) spectra of one pixel over the whole sweep."""
+        return self.counts[:, x_index - 1, y_index - 1]
+
+    @staticmethod
+    def cumulative_sum(counts: np.ndarray) -> np.ndarray:
+        """Running sums along the last axis with a leading 0, as int64."""
+        cumulative = np.zeros(counts.shape[:-1] + (counts.shape[-1] + 1,), dtype=np.int64)
+        np.cumsum(counts, axis=-1, out=cumulative[..., 1:])
+        return cumulative
+
+    @staticmethod
+    def window_count(cumulative: np.ndarray, start, stop) -> np.ndarray:
+        """
+        Counts in bins start to stop from running sums made by cumulative_sum.
+
+        Gives the same result as counts[..., start:stop].sum(axis=-1), including
+        Python slice handling of negative or out of range bins.
+        """
+        start, stop, _ = slice(start, stop).indices(cumulative.shape[-1] - 1)
+        return cumulative[..., max(start, stop)] - cumulative[..., start]
+
+    @property
+    def cumulative_counts(self) -> np.ndarray:
+        """
+        (modules, x, y, bins + 1) running sums of counts along the bin axis.
+
+        cumulative_counts[..., b] is the sum of the first b bins, so the counts in
+        any ROI are a difference of two slices, see roi_count.
+        """
+        if self._cumulative_counts is None:
+            self._cumulative_counts = self.cumulative_sum(self.counts)
+        return self._cumulative_counts
+
+    def roi_count(self, start, stop) -> np.ndarray:
+        """(modules, x, y) counts in bins start to stop of every pixel."""
+        return self.window_count(self.cumulative_counts, start, stop)
+
+    def roi_counts(self, windows) -> np.ndarray:
+        """(windows, modules, x, y) counts for a list of (start, stop) bin windows."""
+        return np.stack([self.roi_count(start, stop) for start, stop in windows])
+
+    def total_count(self) -> np.ndarray:
+        """(modules, x, y) total counts of every pixel."""
+        return self.cumulative_counts[..., -1]
+
+    def average_spectrum(self, module_index: int) -> np.ndarray:
+        """Average spectrum over all pixels of one module."""
+        summed = self.module_pixels(module_index).sum(axis=0, dtype=np.int64)
+        return summed / self.n_pixels
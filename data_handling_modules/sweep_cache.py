@@ -0,0 +1,227 @@
+import os
+import json
+import logging
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .h3d_scanner import H3DScanner
+from .spectrum_cube import SpectrumCube
+from .instrumentation import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+class SweepCache:
+    """
+    Persistent on-disk cache of parsed sweeps, keyed by the content hash of the file.
+
+    Each entry is a directory <cache_dir>/v<CACHE_VERSION>/<sha256 of the file>/
+    holding:
+    - counts.npy: the SpectrumCube counts, loaded back memory-mapped.
+    - cumulative.npy: the running sums of the counts along the bin axis, also
+      memory-mapped, so ROI counts need no pass over the spectra.
+    - metadata.parquet: the (key, value) metadata pairs in file order, with the bin
+      labels in the schema metadata.
+
+    The cache survives server restarts and is shared by every session, so reopening
+    a sweep costs a hash of the file instead of a full CSV (or .xlsx) parse. Because the counts
+    are memory-mapped, readers only page in the pixel and module slices they touch
+    and concurrent sessions share those pages through the OS page cache.
+
+    Parameters:
+    - cache_dir (str): The directory holding the cache entries.
+    """
+
+    CACHE_VERSION = 1  # bump when the on-disk layout changes
+    CHUNK_SIZE = 1 << 20  # bytes read at a time when hashing
+
+    def __init__(self, cache_dir=".sweep_cache"):
+        self.cache_dir = os.path.join(cache_dir, f"v{self.CACHE_VERSION}")
+
+    @staticmethod
+    @stage_timer.timed("sweep_cache.hash")
+    def file_hash(csv_file, data_source=None) -> str:
+        """SHA-256 of the file content, from a path or an uploaded file object."""
+        digest = hashlib.sha256()
+        if data_source == "Uploaded file":
+            csv_file.seek(0)
+            file = csv_file
+        else:
+            file = open(csv_file, "rb")
+        try:
+            for chunk in iter(lambda: file.read(SweepCache.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        finally:
+            if data_source == "Uploaded file":
+                csv_file.seek(0)  # reset the file pointer
+            else:
+                file.close()
+        return digest.hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.entry_dir(key), "metadata.parquet"))
+
+    @stage_timer.timed("sweep_cache.load")
+    def load(self, key: str, mmap_mode="r") -> SpectrumCube:
+        """The cached cube for key with its counts memory-mapped, or None on a miss."""
+        if key not in self:
+            return None
+        entry_dir = self.entry_dir(key)
+        counts = np.load(os.path.join(entry_dir, "counts.npy"), mmap_mode=mmap_mode)
+        cumulative_counts = None
+        if os.path.exists(os.path.join(entry_dir, "cumulative.npy")):
+            cumulative_counts = np.load(
+                os.path.join(entry_dir, "cumulative.npy"), mmap_mode=mmap_mode
+            )
+        table = pq.read_table(os.path.join(entry_dir, "metadata.parquet"))
+        bin_labels = json.loads(table.schema.metadata[b"bin_labels"])
+        metadata_items = list(
+            zip(table.column("key").to_pylist(), table.column("value").to_pylist())
+        )
+        return SpectrumCube(
+            counts,
+            bin_labels=bin_labels,
+            metadata_items=metadata_items,
+            data_version=key,
+            cumulative_counts=cumulative_counts,
+        )
+
+    @staticmethod
+    def _write_metadata(entry_dir: str, metadata_items, bin_labels):
+        metadata_keys = [k for k, _ in metadata_items]
+        metadata_values = [v for _, v in metadata_items]
+        table = pa.table(
+            {
+                "key": pa.array(metadata_keys, pa.string()),
+                "value": pa.array(metadata_values, pa.string()),
+            },
+            metadata={"bin_labels": json.dumps([str(b) for b in bin_labels or []])},
+        )
+        pq.write_table(table, os.path.join(entry_dir, "metadata.parquet"))
+
+    def save(self, key: str, cube: SpectrumCube):
+        """
+        Writes cube to the cache under key.
+
+        The entry is written to a temporary directory first and renamed into place,
+        so concurrent sessions never see a partial entry.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir)
+        try:
+            np.save(os.path.join(tmp_dir, "counts.npy"), cube.counts)
+            np.save(os.path.join(tmp_dir, "cumulative.npy"), cube.cumulative_counts)
+            self._write_metadata(tmp_dir, cube.metadata_items, cube.bin_labels)
+            os.replace(tmp_dir, self.entry_dir(key))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if key not in self:  # unless another session saved the same entry first
+                raise
+
+    @stage_timer.timed("sweep_cache.convert")
+    def convert(self, key: str, csv_file, data_source=None, n_pixels_x=11, n_pixels_y=11):
+        """
+        One-time conversion of an H3D CSV into a cache entry, one module at a time.
+
+        The counts are written straight into a memory-mapped counts.npy, so the
+        conversion never holds more than one module block in memory.
+
+        A last module block that is incomplete, e.g. of a sweep still being written,
+        is left out. Any other incomplete block raises ValueError and nothing is
+        cached, so a damaged file is never served from the cache.
+
+        Returns:
+        - bool: False if the file has no complete modules.
+        """
+        scanner = H3DScanner(csv_file, data_source, number_of_pixels=n_pixels_x * n_pixels_y)
+        scanner.scan()
+        n_modules = scanner.number_of_modules
+        if n_modules > 0:
+            try:
+                scanner.read_counts(n_modules - 1, None, n_pixels_x, n_pixels_y)
+            except ValueError:
+                logger.warning("Leaving out the unreadable last module %d", n_modules - 1)
+                n_modules -= 1
+        if n_modules == 0:
+            return False
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir)
+        try:
+            shape = (n_modules, n_pixels_x, n_pixels_y, scanner.n_bins)
+            counts = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, "counts.npy"), mode="w+", dtype=np.int32, shape=shape
+            )
+            cumulative = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, "cumulative.npy"),
+                mode="w+",
+                dtype=np.int64,
+                shape=shape[:-1] + (shape[-1] + 1,),
+            )
+            with scanner.open() as file:
+                for m in range(n_modules):
+                    counts[m] = scanner.read_counts(m, file, n_pixels_x, n_pixels_y)
+                    cumulative[m] = SpectrumCube.cumulative_sum(counts[m])
+                bin_labels = list(scanner.read_module(0, file).columns)
+            counts.flush()
+            cumulative.flush()
+            del counts, cumulative  # close the memory maps before the entry is moved
+
+            self._write_metadata(tmp_dir, scanner.metadata_items, bin_labels)
+            os.replace(tmp_dir, self.entry_dir(key))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if key not in self:  # unless another session saved the same entry first
+                raise
+        return True
+
+    @stage_timer.timed("sweep_cache.convert_xlsx")
+    def convert_xlsx(self, key: str, xlsx_file, n_pixels_x=11, n_pixels_y=11):
+        """
+        One-time import of an H3D .xlsx workbook into a cache entry.
+
+        The sheet is read once and the modules and metadata are taken from it in
+        memory, no intermediate CSV is written.
+
+        Returns:
+        - bool: False if the sheet has no modules.
+        """
+        sheet = pd.read_excel(xlsx_file, header=None, dtype=object)
+        cube = SpectrumCube.from_sheet(sheet, n_pixels_x=n_pixels_x, n_pixels_y=n_pixels_y)
+        if cube is None:
+            return False
+        self.save(key, cube)
+        return True
+
+    @staticmethod
+    def is_xlsx(csv_file) -> bool:
+        """True for a path or uploaded file object with an .xlsx name."""
+        name = csv_file if isinstance(csv_file, str) else getattr(csv_file, "name", "")
+        return name.lower().endswith(".xlsx")
+
+    def load_or_parse(self, csv_file, data_source=None) -> SpectrumCube:
+        """
+        Loads the sweep from the cache, converting the CSV (or .xlsx) file on a miss.
+
+        Returns:
+        - SpectrumCube: The sweep with its metadata, or None if the file has no modules.
+        """
+        key = self.file_hash(csv_file, data_source)
+        if key not in self:
+            if self.is_xlsx(csv_file):
+                if data_source == "Uploaded file":
+                    csv_file.seek(0)  # reset the file pointer
+                converted = self.convert_xlsx(key, csv_file)
+            else:
+                converted = self.convert(key, csv_file, data_source)
+            if not converted:
+                return None
+        return self.load(key)
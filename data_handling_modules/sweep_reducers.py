@@ -0,0 +1,133 @@
+import abc
+import numpy as np
+import pandas as pd
+
+from .spectrum_cube import SpectrumCube
+from .transform_df import TransformDf
+
+
+class SweepReducer(abc.ABC):
+    """
+    Base class of the incremental reducers fed by H3DScanner.iter_modules.
+
+    A reducer sees one module at a time through update() and keeps only its
+    running result, so a sweep can be reduced without holding it in memory.
+    """
+
+    @abc.abstractmethod
+    def update(self, module_index: int, spectra: np.ndarray, metadata: dict):
+        """
+        Adds one module to the result.
+
+        Parameters:
+        - module_index (int): 0-based index of the module in the sweep.
+        - spectra (np.ndarray): The (n_pixels_x, n_pixels_y, n_bins) counts of the module.
+        - metadata (dict): The metadata values of the module, e.g. stage_x_mm:.
+        """
+
+    @abc.abstractmethod
+    def result(self):
+        """The reduction of every module seen so far."""
+
+
+class AverageSpectrumReducer(SweepReducer):
+    """Average spectrum over all pixels of every module, as a (modules, bins) array."""
+
+    def __init__(self):
+        self.averages = []
+
+    def update(self, module_index, spectra, metadata):
+        n_bins = spectra.shape[-1]
+        summed = spectra.reshape(-1, n_bins).sum(axis=0, dtype=np.int64)
+        self.averages.append(summed / (spectra.size // n_bins))
+
+    def result(self) -> np.ndarray:
+        return np.array(self.averages)
+
+
+class CountSweepReducer(SweepReducer):
+    """
+    Per-pixel counts of every module, as (modules, n_pixels_x, n_pixels_y) grids.
+
+    Parameters:
+    - bin_peak (int, optional): The peak bin. Without it only total_count is kept.
+    - peak_halfwidth (int): Half the width of the ROI around the peak bin.
+    """
+
+    def __init__(self, bin_peak=None, peak_halfwidth=25):
+        self.bin_peak = bin_peak
+        self.peak_halfwidth = peak_halfwidth
+        self.grids = {"total_count": []}
+        if bin_peak is not None:
+            self.grids.update({"peak_count": [], "non_peak_count": []})
+
+    def update(self, module_index, spectra, metadata):
+        self.grids["total_count"].append(spectra.sum(axis=-1, dtype=np.int64))
+        if self.bin_peak is not None:
+            roi_stats = TransformDf.calculate_roi_stats(
+                spectra, self.bin_peak, self.peak_halfwidth
+            )
+            self.grids["peak_count"].append(roi_stats["peak_count"])
+            self.grids["non_peak_count"].append(roi_stats["non_peak_count"])
+
+    def result(self) -> dict:
+        return {count_type: np.array(grids) for count_type, grids in self.grids.items()}
+
+
+class SummedMapReducer(SweepReducer):
+    """
+    Counts of every pixel summed over the whole sweep, as an (n_pixels_x, n_pixels_y) grid.
+
+    Parameters:
+    - bin_peak (int, optional): The peak bin. Only the peak ROI is summed if given.
+    - peak_halfwidth (int): Half the width of the ROI around the peak bin.
+    """
+
+    def __init__(self, bin_peak=None, peak_halfwidth=25):
+        self.bin_peak = bin_peak
+        self.peak_halfwidth = peak_halfwidth
+        self.summed = None
+
+    def update(self, module_index, spectra, metadata):
+        if self.bin_peak is None:
+            counts = spectra.sum(axis=-1, dtype=np.int64)
+        else:
+            counts = TransformDf.calculate_roi_stats(
+                spectra, self.bin_peak, self.peak_halfwidth
+            )["peak_count"]
+        self.summed = counts if self.summed is None else self.summed + counts
+
+    def result(self) -> np.ndarray:
+        return self.summed
+
+
+class MetadataReducer(SweepReducer):
+    """The metadata of every module, as a DataFrame with one row per module."""
+
+    def __init__(self):
+        self.rows = []
+
+    def update(self, module_index, spectra, metadata):
+        self.rows.append(metadata)
+
+    def result(self) -> pd.DataFrame:
+        return pd.DataFrame(self.rows)
+
+
+def reduce_sweep(modules, *reducers, n_pixels_x=11, n_pixels_y=11):
+    """
+    Feeds a stream of modules through reducers in a single pass.
+
+    Parameters:
+    - modules (iterable): (module_index, DataFrame, metadata) tuples, e.g. from
+      H3DScanner.iter_modules.
+    - reducers (SweepReducer): The reducers to update with every module.
+
+    Returns:
+    - list: The result of every reducer, in the order given.
+    """
+    for module_index, df, metadata in modules:
+        spectra = SpectrumCube.from_df_list([df], n_pixels_x, n_pixels_y).counts[0]
+        for reducer in reducers:
+            reducer.update(module_index, spectra, metadata)
+    return [reducer.result() for reducer in reducers]
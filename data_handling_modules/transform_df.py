@@ -2,6 +2,10 @@ import numpy as np
 import pandas as pd
 from typing import List
 
+from .pixel_layout import PixelLayout
+from .spectrum_cube import SpectrumCube
+from .instrumentation import stage_timer
+
 
 class TransformDf:
     def __init__(
@@ -10,11 +14,16 @@ class TransformDf:
         # bin_peak: int,
         # bin_width: int = 25,
         if_calculate_peak_count: bool = True,
+        n_pixels_x: int = 11,
+        n_pixels_y: int = 11,
     ):
         # self.extracted_df_list = extracted_df_list
         self.df_transformed_list = []
         self.N_DF = None
+        self.cube = None  # SpectrumCube backing the array_bins of transform_all_df
+        self._counts_buffer = None  # preallocated counts grown by extend
         self.if_calculate_peak_count = if_calculate_peak_count
+        self.layout = PixelLayout.get(n_pixels_x, n_pixels_y)  # shared by every module
 
     @staticmethod
     def calculate_peak_count(array: np.array, peak_bin: int, peak_halfwidth=25):
@@ -58,6 +67,52 @@ class TransformDf:
         #     return np.nan
         return peak_height
 
+    @staticmethod
+    def calculate_roi_stats(array, peak_bin, peak_halfwidth, threshold=None, cumulative=None):
+        """
+        Peak ROI statistics of many spectra at once, cropping the ROI only once.
+
+        Gives the same values as calculate_peak_count, calculate_bin_max and
+        calculate_peak_height applied to every spectrum one at a time.
+
+        Args:
+            array (np.ndarray): Spectra along the last axis, e.g. (121, n_bins) for one
+                module or (modules, 121, n_bins) for a whole sweep.
+            peak_bin (int): The peak bin index.
+            peak_halfwidth (int): Half the width of the ROI around the peak bin.
+            threshold (int, optional): Peak heights below this set bin_max to the ROI
+                start. If None, only the counts are calculated.
+            cumulative (np.ndarray, optional): Running sums of array along the last axis,
+                e.g. from SpectrumCube.cumulative_counts. The counts are then differences
+                of two bins instead of sums over the spectra.
+
+        Returns:
+            dict: peak_count, non_peak_count, bin_max and peak_height arrays with the
+            shape array.shape[:-1].
+        """
+        roi_start = peak_bin - peak_halfwidth
+        if cumulative is None:
+            cropped_array = array[..., roi_start : peak_bin + peak_halfwidth]
+            peak_count = cropped_array.sum(axis=-1, dtype=np.int64)
+            total_count = array.sum(axis=-1, dtype=np.int64)
+        else:
+            peak_count = SpectrumCube.window_count(
+                cumulative, roi_start, peak_bin + peak_halfwidth
+            )
+            total_count = cumulative[..., -1]
+        roi_stats = {
+            "peak_count": peak_count,
+            "non_peak_count": total_count - peak_count,
+        }
+        if threshold is not None:
+            cropped_array = array[..., roi_start : peak_bin + peak_halfwidth]
+            peak_height = cropped_array.max(axis=-1)
+            roi_stats["bin_max"] = np.where(
+                peak_height < threshold, roi_start, cropped_array.argmax(axis=-1) + roi_start
+            )
+            roi_stats["peak_height"] = peak_height
+        return roi_stats
+
     @staticmethod
     def avg_neighbor_counts(df, x_index, y_index, count_type='peak_count'):
         sum_counts = 0
@@ -75,12 +130,64 @@ class TransformDf:
     def leaking_ratio(row, count_type='peak_count'):
         return row['peak_count'] / row['avg_neighbor_counts']
 
-    def transform_df(self, df: pd.DataFrame) -> pd.DataFrame:
+    @staticmethod
+    def calculate_avg_neighbor_counts(grid: np.ndarray) -> np.ndarray:
+        """
+        Average of the 4 nearest neighbors of every pixel, for many modules at once.
+
+        Same as avg_neighbor_counts for every pixel: neighbors outside the tile are
+        left out of the average, so edge pixels average 3 and corners 2 neighbors.
+
+        Args:
+            grid (np.ndarray): Counts with the shape (..., n_pixels_x, n_pixels_y),
+                e.g. (modules, 11, 11) for a whole sweep.
+
+        Returns:
+            np.ndarray: The average neighbor counts, same shape as grid.
+        """
+        n_pixels_x, n_pixels_y = grid.shape[-2:]
+        padded = np.pad(grid, [(0, 0)] * (grid.ndim - 2) + [(1, 1), (1, 1)])
+        neighbor_sum = (
+            padded[..., :-2, 1:-1]  # x - 1
+            + padded[..., 2:, 1:-1]  # x + 1
+            + padded[..., 1:-1, :-2]  # y - 1
+            + padded[..., 1:-1, 2:]  # y + 1
+        )
+        return neighbor_sum / PixelLayout.get(n_pixels_x, n_pixels_y).n_neighbors
+
+    @stage_timer.timed("leaking_ratio", items=len)
+    def add_leaking_ratio_all(self, count_type="peak_count"):
+        """
+        Add the avg_neighbor_counts and leaking_ratio columns to all the DataFrames.
+
+        leaking_ratio is count_type divided by the average count_type of the nearest
+        neighbors, computed on the (modules, x, y) grid of the whole sweep at once.
+        """
+        if self.df_transformed_list == []:
+            return self.df_transformed_list
+
+        layout = self.layout
+        grid = np.stack(
+            [df[count_type].to_numpy() for df in self.df_transformed_list]
+        ).reshape(-1, layout.n_pixels_x, layout.n_pixels_y)
+        avg_neighbor_counts = self.calculate_avg_neighbor_counts(grid)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            leaking_ratio = grid / avg_neighbor_counts
+
+        for m, df_new in enumerate(self.df_transformed_list):
+            df_new["avg_neighbor_counts"] = avg_neighbor_counts[m].ravel()
+            df_new["leaking_ratio"] = leaking_ratio[m].ravel()
+        return self.df_transformed_list
+
+    def transform_df(self, df: pd.DataFrame, spectra: np.ndarray = None) -> pd.DataFrame:
         """
         Transforms a DataFrame by adding new columns and performing calculations.
 
         Args:
             df (pandas.DataFrame): The input DataFrame.
+            spectra (np.ndarray, optional): The (n_pixels, n_bins) view of this module in a
+                SpectrumCube. The array_bins rows are views into it instead of copies.
+                Built from df if not given.
             bin_peak (int): The peak bin index, used to calculate the peak counts.
             bin_width (int, optional): The width of the bin range. Defaults to 25.
             n_bins (int, optional): The number of bin columns in the DataFrame. Defaults to 2000.
@@ -90,69 +197,75 @@ class TransformDf:
 
         """
         
-        df_bins = df.iloc[:, :] # grab all columns and rows from input DataFrame
-        # if df_bins.shape[1] != 200 and df_bins.shape[1] != 2000:
-        #     print(f"{df_bins.shape[1] = }")
+        layout = self.layout
+        if spectra is None:
+            spectra = SpectrumCube.from_df_list(
+                [df], layout.n_pixels_x, layout.n_pixels_y
+            ).module_pixels(0)
+        # if spectra.shape[1] != 200 and spectra.shape[1] != 2000:
+        #     print(f"{spectra.shape[1] = }")
         #     raise ValueError("The DataFrame does not have the correct number of bins.")
-        # elif df_bins.shape[0] != 121:
+        # elif spectra.shape[0] != 121:
         #     raise ValueError("The DataFrame does not have the correct number of pixels.")
         
-        df_new = pd.DataFrame(index=range(1, 122)) # create a new DataFrame with 121 rows
-        if df_new.shape[0] != 121:
+        if spectra.shape[0] != layout.n_pixels:
             raise ValueError("The DataFrame does not have the correct number of pixels.")
 
-        df_new["x_index"] = np.nan
-        df_new["y_index"] = np.nan
+        # x_index, y_index and pixel_id come precomputed from the cached layout
+        df_new = layout.frame.copy()
 
-        for xi in range(11):
-            for yi in range(11):
-                df_new.loc[xi * 11 + yi + 1, "x_index"] = xi + 1
-                df_new.loc[xi * 11 + yi + 1, "y_index"] = yi + 1
+        # one view per pixel row, the data stays in the contiguous spectra array
+        df_new["array_bins"] = list(spectra)
 
-        # change data type to save memory
-        df_new["x_index"] = df_new["x_index"].astype(int)
-        df_new["y_index"] = df_new["y_index"].astype(int)
-        df_new["pixel_id"] = df_new.index
-
-        df_new["array_bins"] = df_bins.apply(lambda row: np.array(row), axis=1)
-
-        df_new["total_count"] = df_new["array_bins"].apply(sum)
-        df_new["total_count"] = df_new["total_count"].astype(int)
+        df_new["total_count"] = spectra.sum(axis=1, dtype=np.int64)
         df_new["total_counts_norm"] = round(
             df_new["total_count"] / df_new["total_count"].max(), 3
         )
-        df_new["is_edge"] = (
-            (df_new["x_index"] == 1)
-            | (df_new["x_index"] == 11)
-            | (df_new["y_index"] == 1)
-            | (df_new["y_index"] == 11)
-        )
+        df_new["is_edge"] = layout.is_edge.ravel()
 
         return df_new
 
     def add_peak_counts(self, df_new: pd.DataFrame, bin_peak, bin_width) -> pd.DataFrame:
         """Add the peak_count and non_peak_count columns to the DataFrame."""
-        df_new["peak_count"] = df_new["array_bins"].apply(
-            lambda x: self.calculate_peak_count(x, bin_peak, bin_width)
+        roi_stats = self.calculate_roi_stats(
+            np.stack(df_new["array_bins"].values), bin_peak, bin_width
         )
+        df_new["peak_count"] = roi_stats["peak_count"]
         df_new["non_peak_count"] = df_new["total_count"] - df_new["peak_count"]
         
         return df_new
     
     def add_bin_max(self, df_new, bin_peak, bin_width, threshold):
-        df_new["bin_max"] = df_new["array_bins"].apply(
-            lambda x: self.calculate_bin_max(x, bin_peak, bin_width, threshold))
+        roi_stats = self.calculate_roi_stats(
+            np.stack(df_new["array_bins"].values), bin_peak, bin_width, threshold
+        )
+        df_new["bin_max"] = roi_stats["bin_max"]
         
         return df_new
 
     def add_peak_height(self, df_new, bin_peak, bin_width, threshold):
-        df_new["peak_height"] = df_new["array_bins"].apply(
-            lambda x: self.calculate_peak_height(x, bin_peak, bin_width, threshold))
+        roi_stats = self.calculate_roi_stats(
+            np.stack(df_new["array_bins"].values), bin_peak, bin_width, threshold
+        )
+        df_new["peak_height"] = roi_stats["peak_height"]
         
         return df_new   
-    
-        
 
+    def stacked_spectra(self) -> np.ndarray:
+        """(modules, pixels, bins) spectra of all the transformed DataFrames."""
+        if self.cube is not None and self.cube.n_modules == len(self.df_transformed_list):
+            return self.cube.counts.reshape(self.cube.n_modules, self.cube.n_pixels, -1)
+        return np.stack([np.stack(df["array_bins"].values) for df in self.df_transformed_list])
+
+    def stacked_cumulative(self) -> np.ndarray:
+        """(modules, pixels, bins + 1) running sums of the cube, or None without a cube."""
+        if self.cube is not None and self.cube.n_modules == len(self.df_transformed_list):
+            return self.cube.cumulative_counts.reshape(
+                self.cube.n_modules, self.cube.n_pixels, -1
+            )
+        return None
+
+    @stage_timer.timed("transform_df", items=len)
     def transform_all_df(self, extracted_df_list: List[pd.DataFrame]):
         """
         Transforms all the DataFrames in the list.
@@ -167,22 +280,128 @@ class TransformDf:
             raise ValueError("The input list is empty.")
 
         self.df_transformed_list = []  # reset the list
-        for df in extracted_df_list:
-            df_new = self.transform_df(df)
+        self.cube = SpectrumCube.from_df_list(
+            extracted_df_list, self.layout.n_pixels_x, self.layout.n_pixels_y
+        )
+        for m, df in enumerate(extracted_df_list):
+            df_new = self.transform_df(df, self.cube.module_pixels(m))
             self.df_transformed_list.append(df_new)
         self.N_DF = len(self.df_transformed_list)
         return self.df_transformed_list
     
+    @stage_timer.timed("transform_df", items=len)
+    def transform_cube(self, cube: SpectrumCube):
+        """
+        Transforms every module of a SpectrumCube, e.g. one loaded from a SweepCache.
+
+        Returns:
+        - list: The transformed DataFrames, with array_bins rows viewing the cube.
+        """
+        self.cube = cube
+        self.df_transformed_list = [
+            self.transform_df(None, cube.module_pixels(m)) for m in range(cube.n_modules)
+        ]
+        self.N_DF = len(self.df_transformed_list)
+        return self.df_transformed_list
+
+    def copy_transformed(self) -> "TransformDf":
+        """
+        A TransformDf on the same cube with copies of the transformed DataFrames.
+
+        Peak columns can then be added for new peak parameters without touching
+        this instance, while the array_bins views into the cube stay shared.
+        """
+        TD = TransformDf(
+            self.if_calculate_peak_count, self.layout.n_pixels_x, self.layout.n_pixels_y
+        )
+        TD.cube = self.cube
+        TD.df_transformed_list = [df.copy() for df in self.df_transformed_list]
+        TD.N_DF = self.N_DF
+        return TD
+
+    @stage_timer.timed("transform_df.extend", items=len)
+    def extend(self, other: "TransformDf"):
+        """
+        Appends the transformed modules of other, e.g. blocks newly appended to a sweep
+        that is still being acquired.
+
+        The DataFrames of other are kept as they are, so earlier modules are not
+        transformed again. The spectra are appended to a counts buffer that doubles
+        its capacity when full, so only the new modules are copied and re-pointed,
+        except when the buffer grows, and a live sweep costs amortised O(1) per module.
+
+        Returns:
+        - list: All the transformed DataFrames.
+        """
+        if self.cube is None:
+            self.cube, self.df_transformed_list = other.cube, list(other.df_transformed_list)
+            self.N_DF = len(self.df_transformed_list)
+            return self.df_transformed_list
+
+        n_old = self.cube.n_modules
+        n_total = n_old + other.cube.n_modules
+        buffer = self._counts_buffer
+        repoint = range(n_old, n_total)
+        if buffer is None or self.cube.counts.base is not buffer or len(buffer) < n_total:
+            capacity = max(n_total, 2 * n_old)
+            buffer = np.empty((capacity,) + self.cube.counts.shape[1:], self.cube.counts.dtype)
+            buffer[:n_old] = self.cube.counts
+            self._counts_buffer = buffer
+            repoint = range(n_total)  # the earlier modules moved as well
+        buffer[n_old:n_total] = other.cube.counts
+
+        self.cube = SpectrumCube(
+            buffer[:n_total],
+            bin_labels=self.cube.bin_labels,
+            metadata_items=self.cube.metadata_items,
+        )
+        self.df_transformed_list.extend(other.df_transformed_list)
+        for m in repoint:
+            self.df_transformed_list[m]["array_bins"] = list(self.cube.module_pixels(m))
+        self.N_DF = len(self.df_transformed_list)
+        return self.df_transformed_list
+
+    @stage_timer.timed("roi_stats", items=len)
+    def add_roi_stats_all(self, bin_peak, bin_width, threshold, include_peak_height=True):
+        """Add peak_count, non_peak_count, bin_max and peak_height to all DataFrames in one pass."""
+        if self.df_transformed_list == []:
+            return self.df_transformed_list
+
+        roi_stats = self.calculate_roi_stats(
+            self.stacked_spectra(), bin_peak, bin_width, threshold, self.stacked_cumulative()
+        )
+        if not include_peak_height:
+            del roi_stats["peak_height"]
+        for m, df_new in enumerate(self.df_transformed_list):
+            for column, values in roi_stats.items():
+                df_new[column] = values[m]
+        return self.df_transformed_list
+    
+    @stage_timer.timed("roi_stats", items=len)
     def add_peak_counts_all(self, bin_peak, bin_width):
         """Add the peak counts to all the DataFrames in the list."""
-        for df_new in self.df_transformed_list:
-            df_new = self.add_peak_counts(df_new, bin_peak, bin_width)
+        if self.df_transformed_list == []:
+            return self.df_transformed_list
+
+        roi_stats = self.calculate_roi_stats(
+            self.stacked_spectra(), bin_peak, bin_width, cumulative=self.stacked_cumulative()
+        )
+        for m, df_new in enumerate(self.df_transformed_list):
+            df_new["peak_count"] = roi_stats["peak_count"][m]
+            df_new["non_peak_count"] = roi_stats["non_peak_count"][m]
         return self.df_transformed_list
     
+    @stage_timer.timed("roi_stats", items=len)
     def add_bin_max_all(self, bin_peak, bin_width, threshold, include_peak_height=True):
         """Add bin_max and peak_heights to Dataframes"""
-        for df_new in self.df_transformed_list:
-            df_new = self.add_bin_max(df_new, bin_peak, bin_width, threshold)
+        if self.df_transformed_list == []:
+            return self.df_transformed_list
+
+        roi_stats = self.calculate_roi_stats(
+            self.stacked_spectra(), bin_peak, bin_width, threshold
+        )
+        for m, df_new in enumerate(self.df_transformed_list):
+            df_new["bin_max"] = roi_stats["bin_max"][m]
             if include_peak_height:
-                df_new = self.add_peak_height(df_new, bin_peak, bin_width, threshold)
-        return self.df_transformed_list
\ No newline at end of file
+                df_new["peak_height"] = roi_stats["peak_height"][m]
+        return self.df_transformed_list
@@ -5,7 +5,14 @@ from .plotly_modules import (
     create_spectrum_average,
     create_spectrum_pixel,
     create_pixelized_heatmap,
+    create_heatmap_animation,
     create_surface_plot_3d,
     create_spectrum_pixel_sweep,
     create_count_sweep,
+    pixel_row_index,
+    pixel_grid,
+    pixel_sweep_counts,
+    min_max_indices,
+    downsample_trace,
 )
+from .figure_cache import FigureCache, figure_cache
@@ -0,0 +1,101 @@
+import threading
+import collections
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+class FigureCache:
+    """
+    LRU cache of built figures, keyed on a data version token and the view arguments.
+
+    Every Streamlit widget change reruns the whole dashboard, but most panels get
+    the same inputs again. figure() calls a builder only if the same builder has
+    not been called with the same data version and arguments recently, and
+    otherwise returns a copy of the cached figure, which is much cheaper than
+    rebuilding it. The data itself is never hashed, only its data_version token,
+    e.g. the SweepCache key of the sweep plus the module index.
+
+    Parameters:
+    - max_entries (int): The number of figures kept, least recently used dropped first.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._figures = collections.OrderedDict()
+        self._lock = threading.Lock()  # shared by the sessions of the app
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0  # calls without a data version or with unhashable arguments
+        self.evictions = 0
+
+    @classmethod
+    def freeze(cls, value):
+        """A hashable equivalent of a view argument, e.g. a list of pixel tuples."""
+        if isinstance(value, (list, tuple)):
+            return tuple(cls.freeze(v) for v in value)
+        if isinstance(value, dict):
+            return tuple(sorted((k, cls.freeze(v)) for k, v in value.items()))
+        if isinstance(value, np.ndarray):
+            return (value.dtype.str, value.shape, value.tobytes())
+        hash(value)  # raises TypeError for anything else unhashable
+        return value
+
+    def figure(self, builder, data, data_version, *args, **kwargs) -> go.Figure:
+        """
+        builder(data, *args, **kwargs), reused while data_version and the arguments are unchanged.
+
+        data_version must change whenever data does. If it is None, e.g. for a
+        sweep still being acquired, the figure is always built. The returned
+        figure is a copy, so callers may update its layout.
+        """
+        try:
+            key = (
+                builder.__module__,
+                builder.__qualname__,
+                data_version,
+                self.freeze(args),
+                self.freeze(kwargs),
+            )
+        except TypeError:
+            key = None
+        if data_version is None or key is None:
+            with self._lock:
+                self.uncached += 1
+            return builder(data, *args, **kwargs)
+
+        with self._lock:
+            fig = self._figures.get(key)
+            if fig is not None:
+                self.hits += 1
+                self._figures.move_to_end(key)
+        if fig is not None:
+            return go.Figure(fig)
+
+        fig = builder(data, *args, **kwargs)
+        with self._lock:
+            self.misses += 1
+            self._figures[key] = fig
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+                self.evictions += 1
+        return go.Figure(fig)
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncached": self.uncached,
+                "evictions": self.evictions,
+                "size": len(self._figures),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+# shared by every session of the dashboard
+figure_cache = FigureCache()
@@ -1,14 +1,84 @@
+import functools
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 
+from data_handling_modules import TransformDf, CountTable, stage_timer
+
 DISCRETE_COLORS = px.colors.qualitative.Light24
 # DISCRETE_COLORS = px.colors.qualitative.Dark24
 
-def calculate_peak_count(array: np.array, peak_bin: int, peak_halfwidth=25):
-    """Calculate the counts in a peak given the array and the peak bin number."""
-    peak_count = np.sum(array[peak_bin - peak_halfwidth : peak_bin + peak_halfwidth])
-    return peak_count
+def pixel_row_index(df):
+    """Map each (x_index, y_index) to its row position in a transformed DataFrame.
+
+    Every DataFrame from TransformDf has the same pixel layout, so the index built
+    from one module can be reused for all modules of a sweep.
+    """
+    pixel_coords = zip(df["x_index"].tolist(), df["y_index"].tolist())
+    return {pixel: row for row, pixel in enumerate(pixel_coords)}
+
+
+def pixel_grid(df, count_type):
+    """(x, y) grid of one count column of a transformed DataFrame, NaN for missing pixels.
+
+    Scatters the column by x_index and y_index, the same table as
+    pivot_table(index="y_index", columns="x_index") transposed, without a groupby.
+    """
+    x_rows = df["x_index"].to_numpy() - 1
+    y_rows = df["y_index"].to_numpy() - 1
+    grid = np.full((x_rows.max() + 1, y_rows.max() + 1), np.nan)
+    grid[x_rows, y_rows] = df[count_type].to_numpy()
+    return grid
+
+
+def pixel_sweep_counts(
+    cube,
+    count_type,
+    x_index,
+    y_index,
+    min_data_range=None,
+    max_data_range=None,
+    bin_peak=None,
+    peak_halfwidth=25,
+    peak_threshold=None,
+):
+    """count_type of one pixel over a range of modules of a SpectrumCube.
+
+    Only the spectra of that pixel are read, so a memory-mapped cube pages in
+    just this slice of the sweep.
+    """
+    spectra = cube.pixel_sweep(x_index, y_index)[min_data_range:max_data_range]
+    if count_type == "total_count":
+        return spectra.sum(axis=-1, dtype=np.int64)
+    if count_type == "pixel_id":
+        return np.full(len(spectra), cube.pixel_id[x_index - 1, y_index - 1])
+
+    if bin_peak is None:
+        raise ValueError(f"bin_peak is needed to calculate {count_type} from a SpectrumCube")
+    if count_type in ("avg_neighbor_counts", "leaking_ratio"):
+        # same as add_leaking_ratio_all, from the peak counts of the 2 to 4 neighbors
+        peak_args = (min_data_range, max_data_range, bin_peak, peak_halfwidth)
+        neighbors = [
+            (x_index + dx, y_index + dy)
+            for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1))
+            if 1 <= x_index + dx <= cube.n_pixels_x and 1 <= y_index + dy <= cube.n_pixels_y
+        ]
+        neighbor_sum = sum(
+            pixel_sweep_counts(cube, "peak_count", x, y, *peak_args) for x, y in neighbors
+        )
+        avg_neighbor_counts = neighbor_sum / len(neighbors)
+        if count_type == "avg_neighbor_counts":
+            return avg_neighbor_counts
+        peak_count = pixel_sweep_counts(cube, "peak_count", x_index, y_index, *peak_args)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return peak_count / avg_neighbor_counts
+
+    roi_stats = TransformDf.calculate_roi_stats(
+        spectra, bin_peak, peak_halfwidth, peak_threshold
+    )
+    if count_type not in roi_stats:
+        raise ValueError(f"{count_type} cannot be calculated from the spectra of one pixel")
+    return roi_stats[count_type]
 
 
 def add_peak_lines(fig, bin_peak, max_y, peak_halfwidth=25):
@@ -43,6 +113,48 @@ def add_peak_lines(fig, bin_peak, max_y, peak_halfwidth=25):
     return fig
 
 
+def min_max_indices(y, max_points):
+    """Indices of the minimum and maximum of equal-width buckets of y, plus both ends, in order."""
+    n_points = len(y)
+    if n_points <= max_points:
+        return np.arange(n_points)
+    bucket_width = -(-n_points // max(1, (max_points - 2) // 2))  # ceil division
+    buckets = np.pad(y, (0, -n_points % bucket_width), mode="edge").reshape(-1, bucket_width)
+    starts = np.arange(len(buckets)) * bucket_width
+    indices = np.concatenate(
+        [[0, n_points - 1], starts + buckets.argmin(axis=1), starts + buckets.argmax(axis=1)]
+    )
+    return np.unique(np.minimum(indices, n_points - 1))
+
+
+MIN_POINTS_PER_TRACE = 20  # floor of a trace's share of the figure's point budget
+
+
+def downsample_trace(x, y, max_points=None, x_range=None, n_traces=1, **kwargs):
+    """
+    The points of a spectrum trace worth sending to the browser.
+
+    max_points is the budget of the whole figure, shared equally by its n_traces
+    traces with at least MIN_POINTS_PER_TRACE each, so the payload stays bounded
+    however many mask positions a sweep has. Without max_points the trace is
+    returned unchanged. With it, the trace is cropped to x_range, keeping one point
+    beyond each end so the line still reaches the axis edges, and then reduced to
+    its share by keeping the minimum and maximum of every bucket, so narrow peaks
+    survive. Other keyword arguments are ignored, so the builders can pass their
+    **kwargs through.
+    """
+    if max_points is None:
+        return x, y
+    max_points = max(MIN_POINTS_PER_TRACE, max_points // max(n_traces, 1))
+    x, y = np.asarray(x), np.asarray(y)
+    if x_range is not None:
+        start = max(np.searchsorted(x, min(x_range), side="left") - 1, 0)
+        stop = np.searchsorted(x, max(x_range), side="right") + 1
+        x, y = x[start:stop], y[start:stop]
+    keep = min_max_indices(y, max_points)
+    return x[keep], y[keep]
+
+
 def update_x_axis_range(fig, x_range):
     fig.update_xaxes(range=[min(x_range), max(x_range)])
     return fig
@@ -53,6 +165,64 @@ def update_y_axis_range(fig, y_range):
     return fig
 
 
+def axis_range(value_range):
+    """(min, max) of a range slider value, hashable for the layout templates, or None."""
+    if value_range is None:
+        return None
+    return (min(value_range), max(value_range))
+
+
+def finite_range(values, axis=None, keepdims=False):
+    """
+    (min, max) of the finite values, ignoring NaN and inf, e.g. the leaking_ratio of
+    pixels without neighbor counts. NaN where there are no finite values.
+    """
+    finite = np.isfinite(values)
+    low = np.min(values, axis=axis, keepdims=keepdims, initial=np.inf, where=finite)
+    high = np.max(values, axis=axis, keepdims=keepdims, initial=-np.inf, where=finite)
+    no_values = ~np.any(finite, axis=axis, keepdims=keepdims)
+    return np.where(no_values, np.nan, low), np.where(no_values, np.nan, high)
+
+
+def color_range_of(values):
+    """The finite range of values for range_color, or None to let plotly choose."""
+    low, high = finite_range(values)
+    if np.isnan(low):
+        return None
+    return [float(low), float(high)]
+
+
+@functools.lru_cache(maxsize=64)
+def spectrum_sweep_layout(x_range=None, y_range=None) -> dict:
+    """
+    Layout of create_spectrum_pixel_sweep as a plain dict, built once per axis setup.
+
+    The webgl figures start from this template and only bring their own traces.
+    Shared between calls, so never modify the returned dict.
+    """
+    fig = go.Figure()
+    if x_range is not None:
+        fig = update_x_axis_range(fig, x_range)
+    if y_range is not None:
+        fig = update_y_axis_range(fig, y_range)
+    fig.update_layout(xaxis_title="Bin #", yaxis_title="Counts")
+    return fig.layout.to_plotly_json()
+
+
+@functools.lru_cache(maxsize=64)
+def count_sweep_layout(count_type, x_range=None, y_range=None) -> dict:
+    """Layout of create_count_sweep as a plain dict, see spectrum_sweep_layout."""
+    fig = go.Figure()
+    fig.update_layout(yaxis_title=f"{count_type}", showlegend=True)
+    fig.update_xaxes(showgrid=True, gridwidth=0.1, gridcolor="gray", griddash="dash")
+    if x_range is not None:
+        fig = update_x_axis_range(fig, x_range)
+    if y_range is not None:
+        fig = update_y_axis_range(fig, y_range)
+    return fig.layout.to_plotly_json()
+
+
+@stage_timer.timed("plot.create_pixelized_heatmap", items=lambda fig: len(fig.data))
 def create_pixelized_heatmap(
     df,  # pd.DataFrame
     count_type: str,
@@ -61,19 +231,22 @@ def create_pixelized_heatmap(
     color_range: list[float] = None,
     text_auto=True,  # use ".3g" for 3 significant digits
 ):
-    heatmap_table = df.pivot_table(
-        index="y_index", columns="x_index", values=count_type
-    )
+    # df is a transformed DataFrame or already the (x, y) grid of count_type,
+    # e.g. CountTable.grid(count_type)[module_index]
+    grid = df if isinstance(df, np.ndarray) else pixel_grid(df, count_type)
+    heatmap_table = grid.T  # rows are y_index, columns x_index
 
     if normalization == "normalized" or normalization:
-        max_pixel_value = heatmap_table.values.max()
+        _, max_pixel_value = finite_range(heatmap_table)
         heatmap_table = (heatmap_table / max_pixel_value).round(2)
 
     if color_range is None:
-        color_range = [heatmap_table.values.min(), heatmap_table.values.max()]
+        color_range = color_range_of(heatmap_table)
 
     heatmap_fig = px.imshow(
         heatmap_table,
+        x=np.arange(1, heatmap_table.shape[1] + 1),
+        y=np.arange(1, heatmap_table.shape[0] + 1),
         color_continuous_scale=color_scale,  # use color_scale variable for colorscale
         range_color=color_range,
         text_auto=text_auto,
@@ -93,16 +266,77 @@ def create_pixelized_heatmap(
     return heatmap_fig
 
 
+@stage_timer.timed("plot.create_heatmap_animation", items=lambda fig: len(fig.frames))
+def create_heatmap_animation(
+    grids,  # np.ndarray
+    count_type: str,
+    frame_labels=None,
+    normalization=False,
+    color_scale="Viridis",
+    color_range: list[float] = None,
+    text_auto=True,
+):
+    """
+    Heatmaps of every mask position as the frames of one animated figure.
+
+    grids holds the (modules, x, y) counts of count_type, e.g. CountTable.grid.
+    The whole stack is sent to the browser once, so scrubbing the figure's slider
+    through the mask positions needs no reruns. All frames share one color range,
+    the range of the finite values of the whole stack unless color_range is given.
+
+    frame_labels name the slider steps, e.g. the stage positions, and default to
+    the module index.
+    """
+    heatmap_stack = np.asarray(grids, dtype=np.float64).transpose(0, 2, 1)  # (modules, y, x)
+
+    if normalization == "normalized" or normalization:
+        _, max_pixel_values = finite_range(heatmap_stack, axis=(1, 2), keepdims=True)
+        heatmap_stack = (heatmap_stack / max_pixel_values).round(2)
+
+    if color_range is None:
+        color_range = color_range_of(heatmap_stack)  # inf would make the scale useless
+
+    heatmap_fig = px.imshow(
+        heatmap_stack,
+        x=np.arange(1, heatmap_stack.shape[2] + 1),
+        y=np.arange(1, heatmap_stack.shape[1] + 1),
+        animation_frame=0,
+        color_continuous_scale=color_scale,
+        range_color=color_range,
+        text_auto=text_auto,
+        labels=dict(color="Value", x="X", y="Y", animation_frame="Module"),
+    )
+
+    if frame_labels is not None:
+        for step, label in zip(heatmap_fig.layout.sliders[0].steps, frame_labels):
+            step.label = f"{label}"
+
+    heatmap_fig.update_layout(
+        title=f"{count_type}",
+        xaxis=dict(title="X-index of Pixel"),
+        yaxis=dict(title="Y-index of Pixel"),
+        xaxis_nticks=12,
+        yaxis_nticks=12,
+        margin=dict(l=40, r=40, t=40, b=40),
+        width=700,
+        height=800,
+    )
+
+    return heatmap_fig
+
+
+@stage_timer.timed("plot.create_spectrum_average", items=lambda fig: len(fig.data))
 def create_spectrum_average(df, **kwargs):
     summed_array_bins = np.sum(df["array_bins"].values, axis=0)
     avg_array_bins = summed_array_bins / len(df)
     avg_total_counts = np.sum(df["total_count"].values) / len(df)
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=np.arange(len(avg_array_bins)), y=avg_array_bins))
+    x, y = downsample_trace(np.arange(len(avg_array_bins)), avg_array_bins, **kwargs)
+    fig.add_trace(go.Scatter(x=x, y=y))
 
     if "bin_peak" in kwargs:
-        avg_peak_counts = calculate_peak_count(avg_array_bins, kwargs["bin_peak"])
+        avg_peak_counts = TransformDf.calculate_peak_count(avg_array_bins, kwargs["bin_peak"])
         if "peak_halfwidth" in kwargs:
             fig = add_peak_lines(
                 fig, kwargs["bin_peak"], max(avg_array_bins), kwargs["peak_halfwidth"]
@@ -127,6 +361,7 @@ def create_spectrum_average(df, **kwargs):
     return fig
 
 
+@stage_timer.timed("plot.create_spectrum_pixel", items=lambda fig: len(fig.data))
 def create_spectrum_pixel(
     df,
     include_avg_spectrum,
@@ -134,6 +369,8 @@ def create_spectrum_pixel(
     **kwargs,
 ):
     fig = go.Figure()
+    pixel_rows = pixel_row_index(df)
+    n_traces = len(pixel_indices) + bool(include_avg_spectrum)
 
     for p_idx, pixel_index in enumerate(pixel_indices):
     # for pixel_index in pixel_indices:
@@ -143,12 +380,15 @@ def create_spectrum_pixel(
             raise ValueError("Pixel index must be a tuple of (x_index, y_index)")
 
         if (x_index is not None) and (y_index is not None):
-            pixel_df = df[(df["x_index"] == x_index) & (df["y_index"] == y_index)]
-            array_bins = pixel_df["array_bins"].values[0]
+            pixel_row = pixel_rows[(x_index, y_index)]
+            array_bins = df["array_bins"].values[pixel_row]
+            x, y = downsample_trace(
+                np.arange(1, len(array_bins) + 1), array_bins, n_traces=n_traces, **kwargs
+            )
             fig.add_trace(
                 go.Scatter(
-                    x=np.arange(1, len(array_bins) + 1),
-                    y=array_bins,
+                    x=x,
+                    y=y,
                     name=f"Pixel ({x_index}, {y_index})",
                     mode="lines",
                     line_color = DISCRETE_COLORS[p_idx],
@@ -168,10 +408,13 @@ def create_spectrum_pixel(
     if include_avg_spectrum:
         summed_array_bins = np.sum(df["array_bins"].values, axis=0)
         avg_array_bins = summed_array_bins / len(df)
+        x, y = downsample_trace(
+            np.arange(len(avg_array_bins)), avg_array_bins, n_traces=n_traces, **kwargs
+        )
         fig.add_trace(
             go.Scatter(
-                x=np.arange(len(avg_array_bins)),
-                y=avg_array_bins,
+                x=x,
+                y=y,
                 name="Average Spectrum",
                 line=dict(
                     dash = "dash",
@@ -195,8 +438,8 @@ def create_spectrum_pixel(
 
     # If only one pixel is selected, display the total and peak counts in the title
     if len(pixel_indices) == 1:
-        total_count = pixel_df["total_count"].values[0]
-        peak_count = pixel_df["peak_count"].values[0]
+        total_count = df["total_count"].values[pixel_row]
+        peak_count = df["peak_count"].values[pixel_row]
         fig.update_layout(
             title=f"Pixel ({x_index}, {y_index}), Total count = {total_count}, Peak count = {peak_count}",
         )
@@ -204,6 +447,7 @@ def create_spectrum_pixel(
     return fig
 
 
+@stage_timer.timed("plot.create_spectrum_pixel_sweep", items=lambda fig: len(fig.data))
 def create_spectrum_pixel_sweep(
     df_list,
     x_index,
@@ -214,19 +458,45 @@ def create_spectrum_pixel_sweep(
     colormap=px.colors.sequential.RdBu_r,
     **kwargs,
 ):
-    df_list = df_list[min_data_range:max_data_range]
+    if hasattr(df_list, "pixel_sweep"):  # SpectrumCube, read only this pixel's slice
+        spectra = df_list.pixel_sweep(x_index, y_index)[min_data_range:max_data_range]
+    else:
+        pixel_row = pixel_row_index(df_list[0])[(x_index, y_index)]
+        df_list = df_list[min_data_range:max_data_range]
+        spectra = [df["array_bins"].values[pixel_row] for df in df_list]
+
+    if kwargs.get("webgl"):  # WebGL traces on a cached layout, built in one go
+        traces = []
+        for i, array_bins in enumerate(spectra):
+            x, y = downsample_trace(
+                np.arange(1, len(array_bins) + 1), array_bins, n_traces=len(spectra), **kwargs
+            )
+            traces.append(
+                go.Scattergl(
+                    x=x,
+                    y=y,
+                    name=f"{x_values[i+min_data_range]}",
+                    line_color=colormap[int((i / len(spectra)) * len(colormap))],
+                )
+            )
+        layout = spectrum_sweep_layout(
+            axis_range(kwargs.get("x_range")), axis_range(kwargs.get("y_range"))
+        )
+        return go.Figure(data=traces, layout=layout)
+
     fig = go.Figure()
 
-    num_of_lines = len(df_list)
+    num_of_lines = len(spectra)
 
-    for i, df in enumerate(df_list):
-        pixel_df = df[(df["x_index"] == x_index) & (df["y_index"] == y_index)]
-        array_bins = pixel_df["array_bins"].values[0]
+    for i, array_bins in enumerate(spectra):
         color = colormap[int((i/num_of_lines) * (len(colormap)))]
+        x, y = downsample_trace(
+            np.arange(1, len(array_bins) + 1), array_bins, n_traces=num_of_lines, **kwargs
+        )
         fig.add_trace(
             go.Scatter(
-                x=np.arange(1, len(array_bins) + 1),
-                y=array_bins,
+                x=x,
+                y=y,
                 name=f"{x_values[i+min_data_range]}",
                 line_color=color,
             )
@@ -247,6 +517,7 @@ def create_spectrum_pixel_sweep(
     return fig
 
 
+@stage_timer.timed("plot.create_count_sweep", items=lambda fig: len(fig.data))
 def create_count_sweep(
     df_list,
     count_type,
@@ -259,26 +530,55 @@ def create_count_sweep(
     discrete_colormap = px.colors.qualitative.Light24,
     **kwargs,
 ):
-    df_list = df_list[min_data_range:max_data_range]
     x_values = x_values[min_data_range:max_data_range]
+    for pixel_index in pixel_indices:
+        if not isinstance(pixel_index, tuple):
+            raise ValueError("Pixel index must be a tuple of (x_index, y_index)")
 
-    fig = go.Figure()
+    if hasattr(df_list, "count_table"):  # LazySweep, gather from its precomputed table
+        df_list = df_list.count_table
+    if hasattr(df_list, "pixel_sweep"):  # SpectrumCube, read only the selected pixels
+        counts_per_pixel = [
+            pixel_sweep_counts(
+                df_list,
+                count_type,
+                x_index,
+                y_index,
+                min_data_range,
+                max_data_range,
+                kwargs.get("bin_peak"),
+                kwargs.get("peak_halfwidth", 25),
+                kwargs.get("peak_threshold"),
+            )
+            for x_index, y_index in pixel_indices
+        ]
+    else:
+        if hasattr(df_list, "pixel_sweeps"):  # CountTable
+            count_table = df_list
+        else:  # transformed DataFrames, gather the one count column once
+            count_table = CountTable.from_df_list(df_list, [count_type])
+        # (modules, pixels) gather, one column per pixel
+        counts_per_pixel = list(
+            count_table.pixel_sweeps(count_type, pixel_indices, min_data_range, max_data_range).T
+        )
 
-    counts_per_pixel = []
-    # for pixel_index in pixel_indices:
-    for p_idx, pixel_index in enumerate(pixel_indices):
-        if isinstance(pixel_index, tuple):
-            x_index, y_index = pixel_index
-        else:
-            raise ValueError("Pixel index must be a tuple of (x_index, y_index)")
+    if kwargs.get("webgl"):
+        return count_sweep_webgl(
+            counts_per_pixel,
+            count_type,
+            x_values,
+            pixel_indices,
+            include_markers,
+            include_summed_counts,
+            discrete_colormap,
+            kwargs.get("x_range"),
+            kwargs.get("y_range"),
+        )
 
-        counts = []
-        for i, df in enumerate(df_list):
-            pixel_df = df[(df["x_index"] == x_index) & (df["y_index"] == y_index)]
-            count = pixel_df[count_type].values[0]
-            counts.append(count)
-        counts_per_pixel.append(counts)
+    fig = go.Figure()
 
+    for p_idx, (x_index, y_index) in enumerate(pixel_indices):
+        counts = counts_per_pixel[p_idx]
         fig.add_trace( # lines with labels
             go.Scatter(
                 x=x_values,
@@ -342,6 +642,54 @@ def create_count_sweep(
 
     return fig
 
+def count_sweep_webgl(
+    counts_per_pixel,
+    count_type,
+    x_values,
+    pixel_indices,
+    include_markers,
+    include_summed_counts,
+    discrete_colormap,
+    x_range=None,
+    y_range=None,
+):
+    """
+    The webgl variant of create_count_sweep.
+
+    Every pixel is a single Scattergl trace drawing both its line and its markers,
+    instead of a line trace and a duplicate marker trace, and the layout comes from
+    the cached count_sweep_layout.
+    """
+    marker = None
+    if include_markers:
+        marker = dict(size=8, color=x_values, colorscale="RdBu_r", showscale=False)
+    traces = [
+        go.Scattergl(
+            x=x_values,
+            y=counts,
+            mode="lines+markers" if include_markers else "lines",
+            line=dict(width=3, color=discrete_colormap[p_idx]),
+            marker=marker,
+            name=f"Pixel ({x_index}, {y_index})",
+        )
+        for p_idx, ((x_index, y_index), counts) in enumerate(zip(pixel_indices, counts_per_pixel))
+    ]
+    if include_summed_counts:
+        traces.append(
+            go.Scattergl(
+                x=x_values,
+                y=np.sum(counts_per_pixel, axis=0),
+                mode="lines",
+                line=dict(width=3, dash="dash", color="gray"),
+                opacity=0.8,
+                name="Summed counts",
+            )
+        )
+    layout = count_sweep_layout(count_type, axis_range(x_range), axis_range(y_range))
+    return go.Figure(data=traces, layout=layout)
+
+
+@stage_timer.timed("plot.create_surface_plot_3d", items=lambda fig: len(fig.data))
 def create_surface_plot_3d(figure, color_scale):
     # extract the data from the figure
     z_data = figure["data"][0]["z"]
@@ -1,15 +1,27 @@
+import os
 import streamlit as st
 import plotly.express as px
 
-from data_handling_modules import TransformDf, ExtractModule, ExtractModuleStreamlit
+from data_handling_modules import (
+    TransformDf,
+    LazySweep,
+    CountTable,
+    ExtractModule,
+    ExtractModuleStreamlit,
+    SweepCache,
+    stage_timer,
+    ingest_counters,
+)
 
 from plotting_modules import (
     create_spectrum_average,
     create_spectrum_pixel,
     create_pixelized_heatmap,
+    create_heatmap_animation,
     create_spectrum_pixel_sweep,
     create_count_sweep,
     add_peak_lines,
+    figure_cache,
 )
 
 st.set_page_config(
@@ -51,6 +63,10 @@ app_defaults = {
     },
 }
 
+MODULES_TO_SKIP = 0  # leading mask positions left out of the analysis
+# live mode only follows files in this directory, e.g. where the H3D software writes
+ACQUISITION_DIR = os.environ.get("H3D_ACQUISITION_DIR", "sample_data")
+
 st.title(":chart_with_upwards_trend: Full Data Dashboard")
 st.caption("Last updated: 2025-04-07")
 
@@ -67,59 +83,215 @@ if reverse_color_theme:
 
 count_type = st.sidebar.radio(
     "Choose a data type: ",
-    ("total_count", "peak_count", "non_peak_count", "pixel_id", "bin_max"),
+    ("total_count", "peak_count", "non_peak_count", "pixel_id", "bin_max", "leaking_ratio"),
 )
 
 normalize_check = st.sidebar.checkbox("Normalize heatmap")
 
+SPECTRUM_MAX_POINTS = 20000  # per figure, shared by its traces after cropping
+downsample_spectra = st.sidebar.checkbox(
+    "Downsample spectra",
+    value=False,
+    help="Send only the visible bins, reduced to their minima and maxima, to the browser.",
+)
+spectrum_max_points = SPECTRUM_MAX_POINTS if downsample_spectra else None
+webgl_sweeps = st.sidebar.checkbox(
+    "WebGL sweep plots",
+    value=False,
+    help="Draw the sweep plots with WebGL, one trace per pixel, for long sweeps.",
+)
+
+TIMINGS_LOG = "stage_timings.jsonl"  # JSON lines, one per stage call
+
+show_timings = st.sidebar.checkbox("Show stage timings")
+if show_timings:
+    log_timings = st.sidebar.checkbox(f"Append every rerun to {TIMINGS_LOG}")
+stage_timer.reset()  # the panel shows the breakdown of this rerun only
+timings_panel = st.sidebar.container()
+
+
+@st.cache_resource(max_entries=4)
+def load_sweep(data_file, data_source=None, file_mtime=None):
+    """
+    Raw parse stage, keyed only on the file (its content, or path and mtime).
+
+    Parsed sweeps are cached on disk by file content and come back memory-mapped,
+    so sessions share one SpectrumCube and its pages through the OS page cache.
+    Nothing is transformed here, see lazy_sweep.
+    """
+    cube = SweepCache().load_or_parse(data_file, data_source)
+    if cube is None:
+        return None
+    return cube.select_modules(MODULES_TO_SKIP)
+
+
+@st.cache_resource(max_entries=16)
+def lazy_sweep(_cube, data_version, bin_peak, peak_halfwidth, peak_threshold):
+    """
+    Peak stage, keyed on the raw sweep's data_version and the peak parameters.
+
+    Modules are transformed when the module slider reaches them and kept in the
+    LazySweep's LRU cache, so the first plot does not wait for the whole sweep.
+    The count sweeps read the cube directly.
+    """
+    return LazySweep(_cube, bin_peak, peak_halfwidth, peak_threshold)
+
 
-@st.cache_data
 def parse_uploaded_file(
-    uploaded_file, bin_peak_input, peak_halfwidth, peak_threshold, modules_to_skip=0, data_source=None
+    uploaded_file, bin_peak_input, peak_halfwidth, peak_threshold, data_source=None
 ):
-    EM = ExtractModuleStreamlit(uploaded_file, data_source)
+    file_mtime = None
+    if data_source != "Uploaded file":
+        file_mtime = os.path.getmtime(uploaded_file)
+    with stage_timer.stage("load_sweep"):
+        cube = load_sweep(uploaded_file, data_source, file_mtime)
 
-    extracted_df_list = EM.extract_all_modules2df()
-    
     # Check if any modules were found in the file
-    if not extracted_df_list:
+    if cube is None:
         st.error("No modules found in the file. Please check if the file contains 'H3D_Pixel' data.")
-        return None, None, None, None, None, None, None, None, None
-    
-    extracted_df_list = extracted_df_list[modules_to_skip:]
-    N_MODULES = EM.number_of_modules - modules_to_skip
-
-    TD = TransformDf()
-    df_transformed_list = TD.transform_all_df(extracted_df_list)
-    if bin_peak_input is not None and peak_halfwidth_input is not None:
-        peak_halfwidth = peak_halfwidth_input
-        df_transformed_list = TD.add_peak_counts_all(bin_peak_input, peak_halfwidth)
-        df_transformed_list = TD.add_bin_max_all(
-            bin_peak_input, peak_halfwidth, peak_threshold
-        )
+        return None, None, None, None, None, None, None, None, None, None
+
+    if bin_peak_input is None or peak_halfwidth is None:
+        bin_peak_input = None  # peak-independent columns only
+    df_transformed_list = lazy_sweep(
+        cube, cube.data_version, bin_peak_input, peak_halfwidth, peak_threshold
+    )
+    return sweep_result(cube, df_transformed_list)
+
+
+def follow_sweep(data_file, bin_peak_input, peak_halfwidth, peak_threshold):
+    """
+    Live mode for a sweep still being acquired, see poll_live_sweep.
+
+    The extractor in session_state remembers how far the file has been parsed, so
+    only the module blocks appended since the last poll are parsed and transformed
+    and the earlier mask positions are kept as they are. Changing the peak settings
+    recomputes the peak statistics of the parsed cube instead of parsing it again.
+    """
+    peak_params = (bin_peak_input, peak_halfwidth, peak_threshold)
+    live = st.session_state.get("live_sweep")
+    if live is None or live["data_file"] != data_file:
+        live = {
+            "data_file": data_file,
+            "extractor": ExtractModuleStreamlit(data_file),
+            "n_parsed": 0,  # the module DataFrames are not kept, only counted
+            "TD": None,
+            "peak_params": peak_params,
+        }
+        st.session_state.live_sweep = live
+    elif live["peak_params"] != peak_params:
+        live["peak_params"] = peak_params
+        if live["TD"] is not None:
+            live["TD"].add_roi_stats_all(*peak_params)
+            live["TD"].add_leaking_ratio_all("peak_count")
+
+    poll_live_sweep(live)
+    if live["TD"] is None:
+        return (None,) * 10
+    cube = live["TD"].cube
+    cube.metadata_items = live["extractor"].scanner.metadata_items
+    return sweep_result(cube, live["TD"].df_transformed_list)
+
+
+def poll_live_sweep(live):
+    """Parses and transforms the module blocks appended since the last poll, returns the number of mask positions."""
+    n_parsed = live["n_parsed"]
+    new_df_list = live["extractor"].extract_new_modules()
+    live["n_parsed"] += len(new_df_list)
+    new_df_list = new_df_list[max(0, MODULES_TO_SKIP - n_parsed):]
+    if new_df_list:
+        TD_new = TransformDf()
+        TD_new.transform_all_df(new_df_list)
+        TD_new.add_roi_stats_all(*live["peak_params"])
+        TD_new.add_leaking_ratio_all("peak_count")
+        if live["TD"] is None:
+            live["TD"] = TD_new
+        else:
+            live["TD"].extend(TD_new)
+    return 0 if live["TD"] is None else live["TD"].N_DF
+
+
+def live_refresh(poll_seconds, n_shown):
+    """
+    Polls the live sweep every poll_seconds without blocking the rest of the page.
+
+    The poll runs as a fragment, so widget changes are handled in between, and the
+    whole page is only rerun once more than n_shown mask positions have been parsed.
+    """
+
+    @st.experimental_fragment(run_every=poll_seconds)
+    def poll():
+        n_modules = poll_live_sweep(st.session_state.live_sweep)
+        if n_modules > n_shown:
+            st.rerun()
+        st.caption(f"Live: {n_modules} mask positions, checking every {poll_seconds} s")
+
+    poll()
 
-    x_positions_mm = EM.extract_metadata_list(EM.csv_file, "stage_x_mm:", data_source)
-    y_positions_mm = EM.extract_metadata_list(EM.csv_file, "stage_y_mm:", data_source)
-    x_positions = EM.extract_metadata_list(EM.csv_file, "stage_x_px:", data_source)
-    y_positions = EM.extract_metadata_list(EM.csv_file, "stage_y_px:", data_source)
+
+def acquisition_path(file_name):
+    """file_name resolved inside ACQUISITION_DIR, or None if it leads out of that directory."""
+    directory = os.path.realpath(ACQUISITION_DIR)
+    path = os.path.realpath(os.path.join(directory, file_name))
+    if path == directory or os.path.commonpath([directory, path]) != directory:
+        return None
+    return path
+
+
+def sweep_result(cube, df_transformed_list):
+    """The sweep dimensions, stage positions and DataFrames used by the plots."""
+    N_MODULES = cube.n_modules
+
+    # metadata comes from the same single scan that indexed the modules
+    x_positions_mm = cube.metadata_list("stage_x_mm:")
+    y_positions_mm = cube.metadata_list("stage_y_mm:")
+    x_positions = cube.metadata_list("stage_x_px:")
+    y_positions = cube.metadata_list("stage_y_px:")
     x_positions = [float(x) for x in x_positions]  # convert list of str to float
     y_positions = [float(y) for y in y_positions]  # convert list of str to float
-    heights = EM.extract_metadata_list(EM.csv_file, "height:", data_source)
+    heights = cube.metadata_list("height:")
     # st.write(x_positions, y_positions, heights)
 
     return (
         N_MODULES,
-        EM.n_pixels_x,
-        EM.n_pixels_y,
+        cube.n_pixels_x,
+        cube.n_pixels_y,
         x_positions,
         y_positions,
         x_positions_mm,
         y_positions_mm,
         heights,
         df_transformed_list,
+        cube,
     )
 
 
+def show_stage_timings(container, log_file=None, **context):
+    """Per-stage breakdown of this rerun, optionally appended to log_file."""
+    summary = stage_timer.summary()
+    container.markdown("**Stage timings (this rerun)**")
+    container.dataframe(
+        summary.style.format(
+            {"seconds": "{:.3f}", "peak_memory_mb": "{:.1f}", "items": "{:.0f}"}, na_rep="-"
+        )
+    )
+    container.caption("Stages nest (parse_module runs inside extract_modules), so rows do not add up.")
+    if not stage_timer.tracing_memory():
+        container.caption("Start the server with H3D_TRACE_MEMORY=1 to record peak memory.")
+    counters = ingest_counters.snapshot()
+    container.caption(
+        "Since server start: {modules_parsed} modules parsed, {bytes_read:,} bytes read "
+        "in {parse_seconds:.2f} s, {fallback_parses} pandas fallbacks".format(**counters)
+    )
+    cache_info = figure_cache.cache_info()
+    container.caption(
+        "Figure cache: {hits} hits, {misses} misses, {uncached} uncached, "
+        "{evictions} evictions, {size}/{max_entries} figures".format(**cache_info)
+    )
+    if log_file is not None:
+        stage_timer.dump(log_file, **context)
+
+
 def pixel_selectbox(axis, col_index, module_index, key_str, default_index=1):
     """
     axis: str, x or y
@@ -158,6 +330,7 @@ with st.expander("Mask experiment setup", expanded=True):
 
 
 # st.warning("Only File uploader is working for now")
+live_mode = False  # follow a sweep still being acquired, sample data only
 col = st.columns([0.25, 0.25, 0.5], gap="large")
 with col[0]:
     source = st.radio(":radioactive_sign: Radiation Source", ("Am241", "Co57", "Cs137"), index=1)
@@ -181,7 +354,22 @@ if data_source == "Sample data":
     with col[2]:
         data_file = st.selectbox("Select a sample data file:", ("Co57_masksweep_30min_2024-07-11.csv", "Co57_masksweep_10min_2024-06-28_f.csv"), index=0)
         data_file = r"sample_data/" + data_file
-    st.session_state.start_analysis = True
+        live_mode = st.checkbox(
+            "Live mode", help="Follow a sweep that is still being acquired"
+        )
+        if live_mode:
+            file_name = st.text_input(
+                f"File being acquired in {ACQUISITION_DIR}:", value=os.path.basename(data_file)
+            )
+            data_file = acquisition_path(file_name)
+            poll_seconds = st.number_input("Poll every (s)", min_value=1, value=5, step=1)
+    if data_file is None:
+        st.error(f"Live mode only follows files in {ACQUISITION_DIR}")
+        st.session_state.start_analysis = False
+    else:
+        st.session_state.start_analysis = os.path.exists(data_file)
+        if not st.session_state.start_analysis:
+            st.warning(f"{data_file} does not exist yet")
 elif data_source == "Uploaded file":
     if uploaded_file is not None:
         data_file = uploaded_file
@@ -193,15 +381,25 @@ elif data_source == "Uploaded file":
     
     
 if st.session_state.start_analysis:
-    result = parse_uploaded_file(
-        data_file,
-        bin_peak_input,
-        peak_halfwidth_input,
-        peak_threshold_input,
-        modules_to_skip=0,
-        data_source = data_source
-    )
-    
+    if live_mode:
+        result = follow_sweep(
+            data_file, bin_peak_input, peak_halfwidth_input, peak_threshold_input
+        )
+    else:
+        result = parse_uploaded_file(
+            data_file,
+            bin_peak_input,
+            peak_halfwidth_input,
+            peak_threshold_input,
+            data_source = data_source
+        )
+
+    if live_mode and (result[0] is None or result[0] < 2):
+        # the sliders need at least two mask positions
+        st.info("Waiting for the first mask positions to be written...")
+        live_refresh(poll_seconds, result[0] or 0)
+        st.stop()
+
     # Check if the result is None (no modules found)
     if result[0] is None:
         st.session_state.start_analysis = False
@@ -216,8 +414,13 @@ if st.session_state.start_analysis:
             y_positions_mm,
             heights,
             df_transformed_list,
+            spectrum_store,  # memory-mapped SpectrumCube for the sweep plots
         ) = result
 
+        # tokens for the figure cache, None (always rebuild) in live mode
+        sweep_version = getattr(df_transformed_list, "data_version", None)
+        spectrum_version = spectrum_store.data_version
+
 
     with st.expander("HEATMAP and PIXEL SPECTRUM", expanded=True):
         relative_x_positions = [round(x - x_positions[1], 2) for x in x_positions]
@@ -230,8 +433,15 @@ if st.session_state.start_analysis:
 
             # create a slider to select the module
             module_index = st.slider("Mask position:", 0, N_MODULES - 1, value=1)
-            heatmap_fig = create_pixelized_heatmap(
-                df_transformed_list[module_index],
+            module_version = None if sweep_version is None else (sweep_version, module_index)
+            if hasattr(df_transformed_list, "count_table"):  # no DataFrame needed
+                heatmap_data = df_transformed_list.count_table.grid(count_type)[module_index]
+            else:
+                heatmap_data = df_transformed_list[module_index]
+            heatmap_fig = figure_cache.figure(
+                create_pixelized_heatmap,
+                heatmap_data,
+                module_version,
                 count_type=count_type,
                 normalization=normalize_check,
                 color_scale=color_scale,
@@ -301,14 +511,17 @@ if st.session_state.start_analysis:
                     key="y_max_pixel_select",
                 )
 
-            pixel_spectrum_figure = create_spectrum_pixel(
+            pixel_spectrum_figure = figure_cache.figure(
+                create_spectrum_pixel,
                 df_transformed_list[module_index],
+                module_version,
                 True,  # include_avg_spectrum
                 *st.session_state.pixel_indices,
                 bin_peak=bin_peak_input,
                 peak_halfwidth=peak_halfwidth_input,
                 x_range=range_slider,
                 y_range=[0, st.session_state.counts_max_pixel],
+                max_points=spectrum_max_points,
             )
             # pixel_spectrum_figure.update_layout(title="Select Pixel Spectrum",
             #                                     height=450)
@@ -327,15 +540,45 @@ if st.session_state.start_analysis:
             st.plotly_chart(pixel_spectrum_figure)
 
     with st.expander("Average Spectrum", expanded=False):
-        spectrum_avg_fig = create_spectrum_average(
+        spectrum_avg_fig = figure_cache.figure(
+            create_spectrum_average,
             df_transformed_list[module_index],
+            module_version,
             bin_peak=bin_peak_input,
             peak_halfwidth=peak_halfwidth_input,
             x_range=[0, app_defaults[source]["max_bin"]],
             y_range=[0, st.session_state.counts_max_pixel],
+            max_points=spectrum_max_points,
         )
         st.plotly_chart(spectrum_avg_fig)
 
+    with st.expander("HEATMAP ANIMATION", expanded=False):
+        st.caption(
+            "All mask positions are sent to the browser once, "
+            "so the animation slider scrubs through them without reruns."
+        )
+        if st.checkbox("Animate the heatmap over all mask positions", key="animate_heatmap"):
+            if hasattr(df_transformed_list, "count_table"):
+                heatmap_stack = df_transformed_list.count_table.grid(count_type)
+            else:
+                heatmap_stack = CountTable.from_df_list(df_transformed_list, [count_type]).grid(
+                    count_type
+                )
+            heatmap_animation = figure_cache.figure(
+                create_heatmap_animation,
+                heatmap_stack,
+                sweep_version,
+                count_type,
+                frame_labels=[
+                    f"{m}: ({x}, {y}) px"
+                    for m, (x, y) in enumerate(zip(relative_x_positions, relative_y_positions))
+                ],
+                normalization=normalize_check,
+                color_scale=color_scale,
+                text_auto=".3d",
+            )
+            st.plotly_chart(heatmap_animation)
+
     axes_choice = st.radio(
         "sweep axis",
         ("X-abs", "Y-abs", "X-relative", "Y-relative"),
@@ -398,8 +641,10 @@ if st.session_state.start_analysis:
         with right_panel:
             count_sweep_plot_placeholder = st.empty()
         with left_panel:
-            spectrum_sweep = create_spectrum_pixel_sweep(
-                df_transformed_list,
+            spectrum_sweep = figure_cache.figure(
+                create_spectrum_pixel_sweep,
+                spectrum_store,
+                spectrum_version,
                 x_choice,
                 y_choice,
                 data_range[0],
@@ -407,6 +652,8 @@ if st.session_state.start_analysis:
                 x_values[axes_choice],
                 x_range=range_slider_x,
                 y_range=[0, y_max],
+                max_points=spectrum_max_points,
+                webgl=webgl_sweeps,
             )
             spectrum_sweep = add_peak_lines(
                 spectrum_sweep,
@@ -417,14 +664,17 @@ if st.session_state.start_analysis:
             st.plotly_chart(spectrum_sweep)
 
         # with right_panel:
-        count_sweep = create_count_sweep(
+        count_sweep = figure_cache.figure(
+            create_count_sweep,
             df_transformed_list,
+            sweep_version,
             count_type,
             data_range[0],
             data_range[1],
             x_values[axes_choice],
             discrete_colormap=px.colors.qualitative.T10,
             *pixel_selections,
+            webgl=webgl_sweeps,
         )
         count_sweep.update_layout(xaxis_title=f"{axes_choice} Mask Position (px)")
         count_sweep_plot_placeholder.plotly_chart(count_sweep)
@@ -489,8 +739,10 @@ if st.session_state.start_analysis:
                 key="data_range_2",
             )
 
-        count_sweep_multi_pixel = create_count_sweep(
+        count_sweep_multi_pixel = figure_cache.figure(
+            create_count_sweep,
             df_transformed_list,
+            sweep_version,
             count_type,
             data_range_2[0],
             data_range_2[1],
@@ -499,6 +751,7 @@ if st.session_state.start_analysis:
             include_summed_counts=include_summed_counts,
             *st.session_state.pixel_indices_sweep,
             y_range=[0, count_max],
+            webgl=webgl_sweeps,
         )
 
         count_sweep_multi_pixel.update_layout(
@@ -507,3 +760,12 @@ if st.session_state.start_analysis:
         )
 
         st.plotly_chart(count_sweep_multi_pixel)
+
+    if show_timings:
+        show_stage_timings(
+            timings_panel, TIMINGS_LOG if log_timings else None, data_file=str(data_file)
+        )
+
+    if live_mode:
+        # poll the file, the next poll only parses the blocks appended meanwhile
+        live_refresh(poll_seconds, N_MODULES)
@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import csv
 import codecs
@@ -8,6 +9,7 @@ from plotting_modules import (
     create_spectrum_average,
     create_spectrum_pixel,
     create_pixelized_heatmap,
+    pixel_grid,
 )
 
 st.set_page_config(
@@ -242,17 +244,16 @@ for csv_index, uploaded_csv_file in enumerate(
             columns = st.columns([1,1], gap="large")
             
             with columns[0]:
-                count_table = df.pivot_table(
-                    index="y_index", columns="x_index", values=count_type
-                )
+                # (x, y) grid shared by the slider bounds and the heatmap
+                count_grid = pixel_grid(df, count_type)
 
                 color_range = st.slider(
                     label="Color Range Slider: ",
                     min_value=0,  # min is 0
-                    max_value=int(count_table.max().max()),
+                    max_value=int(np.nanmax(count_grid)),
                     value=( # default range
-                        int(count_table.min().min()),
-                        int(count_table.max().max()),
+                        int(np.nanmin(count_grid)),
+                        int(np.nanmax(count_grid)),
                     ),  
                     step=5,
                     key=f"color_range_{csv_index}",
@@ -260,24 +261,24 @@ for csv_index, uploaded_csv_file in enumerate(
 
                 
                 if normalize_check == True:
-                    max_pixel_value = count_table.values.max()
-                    count_table = (count_table / max_pixel_value).round(2)
+                    max_pixel_value = np.nanmax(count_grid)
+                    normalized_grid = (count_grid / max_pixel_value).round(2)
 
                     # color range slider
                     color_range = st.slider(
                         label="Color Range Slider: ",
                         min_value=0.0,  # min is 0
-                        max_value=float(count_table.max().max()),
+                        max_value=float(np.nanmax(normalized_grid)),
                         value=( # default range
-                            float(count_table.min().min()),
-                            float(count_table.max().max()),
+                            float(np.nanmin(normalized_grid)),
+                            float(np.nanmax(normalized_grid)),
                         ),  
                         step=0.1,
                         key=f"color_range_normalized_{csv_index}",
                     )
 
                 heatmap_fig = create_pixelized_heatmap(
-                    df,
+                    count_grid,
                     count_type,
                     normalization=normalize_check,
                     color_scale=color_scale,